@@ -3,10 +3,14 @@
 # FEC + 2010 US census data for 2012 election simulation
 
 
-from __future__ import division
+from __future__ import division, print_function
 from collections import defaultdict
 from collections import OrderedDict
+from collections import namedtuple
+import hashlib
 import json
+import multiprocessing
+import pickle
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.pylab as pylab
@@ -15,26 +19,49 @@ from matplotlib import rcParams
 import matplotlib.cm as cm
 import matplotlib as mpl
 from scipy import stats
+from scipy.optimize import brentq
+from scipy.special import ndtr, ndtri
+import sklearn
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import classification_report, f1_score, accuracy_score
-from sklearn.metrics import confusion_matrix
-from sklearn.metrics import precision_recall_curve, precision_score, recall_score
+from sklearn.metrics import precision_recall_curve
 import os
 
+# typed columnar copies of the input data are optional
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
 
 main_dir = \
  os.path.expanduser('~/GitHub/election-simulations/basic-exploration-python/data/')
 
+# fitted classifiers, CV results and probabilities (see cached_cv_and_fit)
+fit_cache_dir = \
+ os.path.expanduser('~/GitHub/election-simulations/basic-exploration-python/output/fit-cache/')
+
 # import data
 
+def read_data(path):
+    """read_data(path)
+    read_data reads the CSV file path, or its Feather copy (same
+    name, .feather extension) when that exists and pyarrow is
+    installed; the copy is memory-mapped and keeps column types.
+    returns DataFrame"""
+    feather_path = os.path.splitext(path)[0] + '.feather'
+    if feather is not None and os.path.exists(feather_path):
+        return feather.read_table(feather_path, memory_map = True).to_pandas()
+    return pd.read_csv(path)
+
+
 data_file = 'obama-prediction-net-money-complete.csv'
 
-obama_net_data = pd.read_csv(main_dir + data_file).set_index('state_name')
+obama_net_data = read_data(main_dir + data_file).set_index('state_name')
   
 obama_net_data = obama_net_data.sort_index()
 
 electoral_votes = \
-pd.read_csv(main_dir + 'electoral_votes.csv').set_index('State')
+read_data(main_dir + 'electoral_votes.csv').set_index('State')
 
 electoral_votes = electoral_votes.sort_index()
 
@@ -55,7 +82,7 @@ dark2_colors = \
 
 rcParams['figure.figsize'] = (7, 4)
 rcParams['figure.dpi'] = 150
-rcParams['axes.color_cycle'] = dark2_colors
+rcParams['axes.prop_cycle'] = mpl.cycler(color = dark2_colors)
 rcParams['lines.linewidth'] = 2
 rcParams['axes.facecolor'] = 'white'
 rcParams['font.size'] = 14
@@ -68,44 +95,660 @@ rcParams['font.family'] = 'Helvetica'
 # election simulation and plot functions
 
 
-def simulate_election(model, n_sim, column):
-    """simulate_election(model, n_sim, column)
+sim_seed = 29393848
+electoral_college_size = 538
+
+
+class ElectionResult(object):
+    """ElectionResult(counts, n_sim = None, state_win_prob = None)
+    ElectionResult holds the distribution of Obama Electoral College
+    votes (index 0 to electoral_college_size) shared by the
+    Monte Carlo and exact paths: counts are the number of
+    simulations with each vote total (n_sim simulations) or,
+    with n_sim = None, exact probabilities.
+    state_win_prob is the probability of winning each state"""
+
+    def __init__(self, counts, n_sim = None, state_win_prob = None):
+        self.counts = np.asarray(counts, dtype = np.float64)
+        self.n_sim = n_sim
+        self.pmf = self.counts / self.counts.sum()
+        self.state_win_prob = state_win_prob
+
+    @property
+    def win_prob(self):
+        """probability of at least 269 votes"""
+        return self.pmf[269:].sum()
+
+    def percentile(self, q):
+        """percentile(q)
+        percentile returns the q-th percentile of the vote totals:
+        np.percentile of the simulated totals for Monte Carlo
+        results and the inverse CDF for exact ones"""
+        if self.n_sim is None:
+            return float(np.searchsorted(np.cumsum(self.pmf), q / 100 - 1e-12))
+        # order statistics of the sorted totals, interpolated as np.percentile
+        cum_counts = np.cumsum(self.counts)
+        rank = (self.n_sim - 1) * q / 100
+        lower, upper = np.searchsorted(cum_counts, [np.floor(rank), np.ceil(rank)],
+                                       side = 'right')
+        return lower + (rank - np.floor(rank)) * (upper - lower)
+
+    @property
+    def spread(self):
+        """distance between 5th and 95th percentiles"""
+        return np.abs(self.percentile(5) - self.percentile(95))
+
+    def win_prob_ci(self, z = 1.96):
+        """win_prob_ci(z = 1.96)
+        win_prob_ci returns the Wilson confidence interval of the
+        win probability (z standard errors; about 95% for 1.96),
+        which stays wide enough near 0 and 1; a point for exact
+        results"""
+        if self.n_sim is None:
+            return self.win_prob, self.win_prob
+        p, n = self.win_prob, self.n_sim
+        center = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+        half = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / (1 + z ** 2 / n)
+        return max(center - half, 0), min(center + half, 1)
+
+    def percentile_ci(self, q, z = 1.96):
+        """percentile_ci(q, z = 1.96)
+        percentile_ci returns the distribution-free confidence
+        interval of the q-th percentile: the vote totals at the
+        ranks n q / 100 -/+ z sqrt(n q / 100 (1 - q / 100)) of the
+        sorted simulations; a point for exact results"""
+        if self.n_sim is None:
+            return self.percentile(q), self.percentile(q)
+        n, p = self.n_sim, q / 100
+        half = z * np.sqrt(n * p * (1 - p))
+        ranks = np.clip([np.floor(n * p - half), np.ceil(n * p + half)], 0, n - 1)
+        lower, upper = np.searchsorted(np.cumsum(self.counts), ranks, side = 'right')
+        return lower, upper
+
+
+def result_from_totals(vote_totals):
+    """result_from_totals(vote_totals)
+    result_from_totals builds an ElectionResult from the
+    per-simulation totals or the states x n_sim vote matrix"""
+    if np.ndim(vote_totals) == 2:
+        vote_totals = np.nansum(vote_totals, axis = 0)
+    counts = np.bincount(np.asarray(vote_totals).astype(np.int64),
+                         minlength = electoral_college_size + 1)
+    return ElectionResult(counts, n_sim = len(vote_totals))
+
+
+def draw_wins(probs, n_sim, rng):
+    """draw_wins(probs, n_sim, rng)
+    draw_wins draws the wins for every state at once:
+    a boolean matrix of dimensions states x n_sim
+    from one batch of uniforms compared against
+    the vector of state win probabilities probs"""
+    probs = np.asarray(probs, dtype = np.float64)
+    return rng.random((probs.shape[0], int(n_sim))) < probs[:, np.newaxis]
+
+
+def latent_correlation(regions, national = 0.3, regional = 0.2):
+    """latent_correlation(regions, national = 0.3, regional = 0.2)
+    latent_correlation builds the states x states correlation
+    matrix of a latent vote swing made of a national swing
+    (share national of the variance), a swing shared by the
+    states of each region in regions (e.g. census_region_num,
+    share regional) and a swing of each state (the rest)"""
+    regions = np.asarray(regions)
+    same_region = regions[:, np.newaxis] == regions[np.newaxis, :]
+    corr = national + regional * same_region
+    np.fill_diagonal(corr, 1)
+    return corr
+
+
+def draw_correlated_wins(probs, chol, n_sim, rng):
+    """draw_correlated_wins(probs, chol, n_sim, rng)
+    draw_correlated_wins is the correlated version of draw_wins:
+    one batch of standard normals (states x n_sim) is correlated
+    with chol, the Cholesky factor of the latent correlation
+    matrix, and a state is won where its latent swing is below
+    the normal quantile of its win probability, so each state
+    keeps its win probability (Gaussian copula); single
+    precision is enough for the comparison and faster"""
+    thresholds = stats.norm.ppf(np.asarray(probs, dtype = np.float64))
+    latent = np.dot(chol.astype(np.float32),
+                    rng.standard_normal((chol.shape[0], int(n_sim)),
+                                        dtype = np.float32))
+    return latent < thresholds[:, np.newaxis]
+
+
+def electoral_vote_totals(wins, votes):
+    """electoral_vote_totals(wins, votes)
+    electoral_vote_totals returns the Electoral College votes
+    of each simulation (length n_sim) as a single
+    matrix-vector product of votes and the wins matrix"""
+    return np.dot(np.asarray(votes, dtype = np.float64), wins)
+
+
+def simulation_blocks(n_sim, block_size):
+    """simulation_blocks(n_sim, block_size)
+    simulation_blocks yields (start, stop) bounds
+    that split n_sim simulations into blocks of block_size"""
+    n_sim = int(n_sim)
+    for start in range(0, n_sim, block_size):
+        yield start, min(start + block_size, n_sim)
+
+
+def simulate_election(model, n_sim, column, rng = None, storage = 'float',
+                      block_size = 100000):
+    """simulate_election(model, n_sim, column, rng = None, storage = 'float',
+                         block_size = 100000)
     simulate_election creates a matrix of
     dimensions states x n_sim for a given column
-    from a model (DataFrame with probabilities)"""
-    prob_matrix = np.zeros((model.shape[0], n_sim))
-    vote_matrix = np.zeros((model.shape[0], n_sim))
-    np.random.RandomState(seed = 29393848)
-    
-    # generate wins
-    for row, state in zip(xrange(prob_matrix.shape[0]), xrange(model.shape[0])):
-        prob_matrix[row, :] = \
-          np.random.binomial(n = 1, p = model.ix[state, column], size = (1, n_sim))
-    
-    # electoral college votes
-    for row, state in zip(xrange(prob_matrix.shape[0]), xrange(model.shape[0])):
-        vote_matrix[row, :] = \
-          np.where(prob_matrix[row, :] == 1, model.ix[state, 'Votes'], 0)
-        
-    return prob_matrix, vote_matrix
+    from a model (DataFrame with probabilities).
+    rng is a numpy Generator; a generator seeded
+    with sim_seed is used if none is given.
+    storage = 'float' returns float64 matrices of wins and
+    Electoral College votes; storage = 'bool' or 'packed'
+    returns the wins as a bool matrix or bit-packed along
+    simulations (np.packbits, uint8) together with uint16
+    vote totals, filled in blocks of block_size"""
+    if rng is None:
+        rng = np.random.default_rng(sim_seed)
+    n_sim = int(n_sim)
+    probs = model[column].values
+    votes = model['Votes'].values.astype(np.float64)
+
+    if storage == 'float':
+        # generate wins
+        prob_matrix = draw_wins(probs, n_sim, rng).astype(np.float64)
+
+        # electoral college votes
+        vote_matrix = prob_matrix * votes[:, np.newaxis]
+
+        return prob_matrix, vote_matrix
+
+    if storage == 'packed':
+        outcomes = np.zeros((model.shape[0], (n_sim + 7) // 8), dtype = np.uint8)
+        # packed blocks have to start on a byte boundary
+        block_size = max(block_size - block_size % 8, 8)
+    elif storage == 'bool':
+        outcomes = np.zeros((model.shape[0], n_sim), dtype = np.bool_)
+    else:
+        raise ValueError("storage must be 'float', 'bool' or 'packed'")
+    totals = np.zeros(n_sim, dtype = np.uint16)
+
+    for start, stop in simulation_blocks(n_sim, block_size):
+        wins = draw_wins(probs, stop - start, rng)
+        totals[start:stop] = electoral_vote_totals(wins, votes)
+        if storage == 'packed':
+            outcomes[:, start // 8:(stop + 7) // 8] = np.packbits(wins, axis = 1)
+        else:
+            outcomes[:, start:stop] = wins
+
+    return outcomes, totals
+
+
+def simulate_election_totals(model, n_sim, column, block_size = 100000,
+                             rng = None, corr = None):
+    """simulate_election_totals(model, n_sim, column, block_size = 100000,
+                                rng = None, corr = None)
+    simulate_election_totals is the streaming version of
+    simulate_election: simulations are drawn in blocks of
+    block_size so the states x n_sim matrices are never
+    held in memory at once. With corr (states x states, e.g.
+    from latent_correlation), state outcomes are correlated
+    (draw_correlated_wins with its Cholesky factor, computed once).
+    returns Electoral College votes for each simulation
+    (length n_sim) and number of wins for each state"""
+    if rng is None:
+        rng = np.random.default_rng(sim_seed)
+    n_sim = int(n_sim)
+    probs = model[column].values
+    votes = model['Votes'].values
+    totals = np.zeros(n_sim, dtype = np.int64)
+    state_wins = np.zeros(model.shape[0], dtype = np.int64)
+    chol = None if corr is None else np.linalg.cholesky(corr)
+
+    for start, stop in simulation_blocks(n_sim, block_size):
+        if chol is None:
+            wins = draw_wins(probs, stop - start, rng)
+        else:
+            wins = draw_correlated_wins(probs, chol, stop - start, rng)
+        totals[start:stop] = electoral_vote_totals(wins, votes)
+        state_wins += wins.sum(axis = 1)
+
+    return totals, state_wins
+
+
+def simulate_election_sequential(model, column, tolerance = 0.001,
+                                 spread_tolerance = 2, max_sim = 10 ** 6,
+                                 block_size = 10000, rng = None, corr = None):
+    """simulate_election_sequential(model, column, tolerance = 0.001,
+                                    spread_tolerance = 2, max_sim = 10 ** 6,
+                                    block_size = 10000, rng = None, corr = None)
+    simulate_election_sequential is the sequential mode of
+    simulate_election_totals: simulations are drawn in blocks of
+    block_size into a running histogram of vote totals until the
+    95% confidence interval of the win probability is within
+    +/- tolerance and those of the 5th and 95th percentiles (the
+    spread) are at most spread_tolerance votes wide, or max_sim
+    simulations are used. Models with a win probability near 0
+    or 1 stop after a few blocks.
+    returns an ElectionResult (n_sim: simulations used)"""
+    if int(max_sim) < 1:
+        raise ValueError('max_sim must be at least 1')
+    if int(block_size) < 1:
+        raise ValueError('block_size must be at least 1')
+    if not tolerance > 0:
+        raise ValueError('tolerance must be positive')
+    if rng is None:
+        rng = np.random.default_rng(sim_seed)
+    probs = model[column].values
+    votes = model['Votes'].values
+    chol = None if corr is None else np.linalg.cholesky(corr)
+    histogram = np.zeros(electoral_college_size + 1, dtype = np.int64)
+    state_wins = np.zeros(model.shape[0], dtype = np.int64)
+
+    for start, stop in simulation_blocks(max_sim, block_size):
+        if chol is None:
+            wins = draw_wins(probs, stop - start, rng)
+        else:
+            wins = draw_correlated_wins(probs, chol, stop - start, rng)
+        totals = electoral_vote_totals(wins, votes).astype(np.int64)
+        histogram += np.bincount(totals, minlength = electoral_college_size + 1)
+        state_wins += wins.sum(axis = 1)
+        result = ElectionResult(histogram, n_sim = stop,
+                                state_win_prob = state_wins / stop)
+        lower, upper = result.win_prob_ci()
+        if upper - lower <= 2 * tolerance and \
+          all(np.diff(result.percentile_ci(q))[0] <= spread_tolerance
+              for q in [5, 95]):
+            break
+
+    return result
+
+
+class WhatIfEngine(object):
+    """WhatIfEngine(model, column, n_sim = 10 ** 5, rng = None, corr = None)
+    WhatIfEngine draws n_sim uniforms for every state of model
+    once, quantized to uint16 (steps of 1 / 65536; uniforms of
+    the latent swing of latent_correlation with corr), and
+    evaluates any probability vector on those same draws
+    (common random numbers), so scenario differences carry
+    little noise. Vote totals are kept for the model's own
+    probabilities and only the states whose probabilities
+    change are re-thresholded"""
+    levels = 2 ** 16
+
+    def __init__(self, model, column, n_sim = 10 ** 5, rng = None, corr = None,
+                 block_size = 100000):
+        if rng is None:
+            rng = np.random.default_rng(sim_seed)
+        n_sim = int(n_sim)
+        self.states = model.index
+        self.probs = model[column].values.astype(np.float64)
+        self.votes = model['Votes'].values.astype(np.int32)
+        self.draws = np.zeros((model.shape[0], n_sim), dtype = np.uint16)
+        chol = None if corr is None else np.linalg.cholesky(corr)
+        for start, stop in simulation_blocks(n_sim, block_size):
+            if chol is None:
+                self.draws[:, start:stop] = rng.integers(0, self.levels,
+                                                         (model.shape[0], stop - start),
+                                                         dtype = np.uint16)
+            else:
+                uniforms = ndtr(np.dot(chol, rng.standard_normal((model.shape[0],
+                                                                  stop - start))))
+                self.draws[:, start:stop] = np.minimum(uniforms * self.levels,
+                                                       self.levels - 1)
+        # totals of the model's probabilities, from all stored draws at once
+        self.base_thresholds = self.thresholds(self.probs)
+        self.base_totals = electoral_vote_totals(
+          self.draws < self.base_thresholds[:, np.newaxis], self.votes).astype(np.int32)
+        self.base = result_from_totals(self.base_totals)
+
+    def thresholds(self, probs):
+        """thresholds(probs)
+        thresholds returns the quantized win probabilities:
+        a state is won where its draw is below its threshold"""
+        probs = np.clip(np.asarray(probs, dtype = np.float64), 0, 1)
+        return np.round(probs * self.levels).astype(np.int32)
+
+    def totals(self, probs):
+        """totals(probs)
+        totals returns the Electoral College votes of every draw
+        for the state win probabilities probs: the vote changes of
+        all states whose thresholds differ from the model's are
+        added to the base totals in one product (in float32, exact
+        for vote totals)"""
+        thresholds = self.thresholds(probs)
+        changed = np.flatnonzero(thresholds != self.base_thresholds)
+        draws = self.draws[changed]
+        flips = (draws < thresholds[changed, np.newaxis]).astype(np.float32) - \
+          (draws < self.base_thresholds[changed, np.newaxis])
+        return self.base_totals + \
+          np.dot(self.votes[changed].astype(np.float32), flips).astype(np.int32)
+
+    def scenario(self, shifts):
+        """scenario(shifts)
+        scenario returns the model's win probabilities with the
+        changes in shifts (dict of state: change in probability,
+        e.g. {'Ohio': 0.05}) added, clipped to [0, 1]"""
+        probs = self.probs.copy()
+        for state, shift in shifts.items():
+            position = self.states.get_loc(state)
+            probs[position] = np.clip(probs[position] + shift, 0, 1)
+        return probs
+
+    def what_if(self, shifts):
+        """what_if(shifts)
+        what_if returns the ElectionResult of a scenario"""
+        return result_from_totals(self.totals(self.scenario(shifts)))
+
+    def sweep(self, state, shifts):
+        """sweep(state, shifts)
+        sweep evaluates the changes shifts of one state's win
+        probability on the same draws.
+        returns DataFrame indexed by shift with the win probability
+        and its change from the model's own"""
+        win_probs = [self.what_if({state: shift}).win_prob for shift in shifts]
+        return pd.DataFrame({'win_prob': win_probs,
+                             'change': np.array(win_probs) - self.base.win_prob},
+                            index = pd.Index(shifts, name = state))
+
+
+def simulate_worker_histogram(task):
+    """simulate_worker_histogram(task)
+    simulate_worker_histogram runs one worker's share of
+    simulate_election_parallel: task is (probs, votes, blocks, chol)
+    where blocks is a list of (n_sim, SeedSequence) pairs and
+    chol the Cholesky factor of the state correlations (None
+    for independent states).
+    returns the histogram of Electoral College votes
+    (0 to electoral_college_size) and wins for each state"""
+    probs, votes, blocks, chol = task
+    histogram = np.zeros(electoral_college_size + 1, dtype = np.int64)
+    state_wins = np.zeros(len(probs), dtype = np.int64)
+    for n_sim, seed_seq in blocks:
+        rng = np.random.default_rng(seed_seq)
+        if chol is None:
+            wins = draw_wins(probs, n_sim, rng)
+        else:
+            wins = draw_correlated_wins(probs, chol, n_sim, rng)
+        totals = electoral_vote_totals(wins, votes).astype(np.int64)
+        histogram += np.bincount(totals, minlength = electoral_college_size + 1)
+        state_wins += wins.sum(axis = 1)
+    return histogram, state_wins
+
+
+def simulate_election_parallel(model, n_sim, column, n_workers = None,
+                               seed = sim_seed, block_size = 100000,
+                               corr = None):
+    """simulate_election_parallel(model, n_sim, column, n_workers = None,
+                                  seed = sim_seed, block_size = 100000,
+                                  corr = None)
+    simulate_election_parallel splits n_sim simulations into
+    blocks of block_size and runs them on a pool of n_workers
+    processes (all cores if None). Each block draws from its
+    own stream spawned from the master seed, so the result is
+    identical for any number of workers. corr correlates the
+    states as in simulate_election_totals.
+    returns an ElectionResult"""
+    if int(n_sim) < 1:
+        raise ValueError('n_sim must be at least 1')
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    probs = model[column].values.astype(np.float64)
+    votes = model['Votes'].values.astype(np.float64)
+    bounds = list(simulation_blocks(n_sim, block_size))
+    seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+    blocks = [(stop - start, seed_seq)
+              for (start, stop), seed_seq in zip(bounds, seeds)]
+    chol = None if corr is None else np.linalg.cholesky(corr)
+    tasks = [(probs, votes, blocks[worker::n_workers], chol)
+             for worker in range(min(n_workers, len(blocks)))]
+
+    histogram = np.zeros(electoral_college_size + 1, dtype = np.int64)
+    state_wins = np.zeros(model.shape[0], dtype = np.int64)
+    pool = multiprocessing.Pool(processes = len(tasks))
+    try:
+        for worker_histogram, worker_wins in \
+          pool.imap_unordered(simulate_worker_histogram, tasks):
+            histogram += worker_histogram
+            state_wins += worker_wins
+    finally:
+        pool.close()
+        pool.join()
+
+    n_sim = int(histogram.sum())
+    return ElectionResult(histogram, n_sim = n_sim,
+                          state_win_prob = state_wins / n_sim)
+
+
+# win probability estimate with its standard error
+# and the number of simulations it used
+WinEstimate = namedtuple('WinEstimate', ['win_prob', 'se', 'n_sim'])
+
+
+# state win probabilities are kept this far inside (0, 1) for the
+# likelihood ratios of importance sampling
+prob_clip = 1e-9
+
+
+def tilted_probs(probs, votes, target = 269):
+    """tilted_probs(probs, votes, target = 269)
+    tilted_probs shifts the logits of all state win probabilities
+    (clipped into (0, 1)) by the same multiple of their votes
+    (exponential tilting) so that the expected Electoral College
+    votes equal target; used as the importance sampling
+    distribution around the threshold"""
+    probs = np.clip(np.asarray(probs, dtype = np.float64), prob_clip, 1 - prob_clip)
+    votes = np.asarray(votes, dtype = np.float64)
+    logits = np.log(probs) - np.log1p(-probs)
+
+    def tilted(theta):
+        return 1 / (1 + np.exp(-(logits + theta * votes)))
+
+    theta = brentq(lambda theta: np.dot(votes, tilted(theta)) - target, -5, 5)
+    return tilted(theta)
+
+
+def uniform_wins(uniforms, probs, chol = None):
+    """uniform_wins(uniforms, probs, chol = None)
+    uniform_wins turns a states x n_sim matrix of uniforms into
+    wins: below the win probability for independent states or,
+    with chol, through normal quantiles correlated as in
+    draw_correlated_wins"""
+    if chol is None:
+        return uniforms < probs[:, np.newaxis]
+    return np.dot(chol, ndtri(uniforms)) < ndtri(probs)[:, np.newaxis]
+
+
+def win_units(probs, votes, n_sim, rng, method = 'plain', chol = None,
+              tilted = None):
+    """win_units(probs, votes, n_sim, rng, method = 'plain', chol = None,
+                 tilted = None)
+    win_units draws n_sim simulations with a variance reduction
+    method and returns the independent units whose mean estimates
+    the win probability (at least 269 votes):
+    'plain': one unit per simulation;
+    'antithetic': uniforms u and 1 - u, one unit per pair;
+    'lhs': Latin hypercube, each state's uniforms are spread over
+    n_sim strata, one unit (the win rate) for all n_sim;
+    'importance': states drawn with the tilted probabilities,
+    one unit per simulation weighted by the likelihood ratio of
+    the rarer outcome (a loss when the expected votes reach 269,
+    the win probability being one minus its estimate); this only
+    helps when that outcome is rare, i.e. the win probability is
+    close to 0 or 1 (independent states only)"""
+    probs = np.asarray(probs, dtype = np.float64)
+    n_states = len(probs)
+    if method == 'importance':
+        if chol is not None:
+            raise ValueError('importance sampling needs independent states')
+        wins = draw_wins(tilted, n_sim, rng)
+        clipped = np.clip(probs, prob_clip, 1 - prob_clip)
+        log_win = np.log(clipped) - np.log(tilted)
+        log_loss = np.log1p(-clipped) - np.log1p(-tilted)
+        weights = np.exp(np.dot(log_win - log_loss, wins) + log_loss.sum())
+        won = electoral_vote_totals(wins, votes) >= 269
+        if np.dot(probs, votes) >= 269:
+            return 1 - weights * ~won
+        return weights * won
+    if method == 'plain':
+        draws = [rng.random((n_states, n_sim))]
+    elif method == 'antithetic':
+        uniforms = rng.random((n_states, n_sim // 2))
+        draws = [uniforms, 1 - uniforms]
+    elif method == 'lhs':
+        strata = rng.permuted(np.tile(np.arange(n_sim), (n_states, 1)), axis = 1)
+        draws = [(strata + rng.random((n_states, n_sim))) / n_sim]
+    else:
+        raise ValueError("method must be 'plain', 'antithetic', 'lhs' or 'importance'")
+    won = [electoral_vote_totals(uniform_wins(uniforms, probs, chol), votes) >= 269
+           for uniforms in draws]
+    if method == 'lhs':
+        return np.array([won[0].mean()])
+    return np.mean(won, axis = 0)
+
+
+def estimate_win_probability(model, n_sim, column, method = 'antithetic',
+                             rng = None, block_size = 100000, corr = None):
+    """estimate_win_probability(model, n_sim, column, method = 'antithetic',
+                                rng = None, block_size = 100000, corr = None)
+    estimate_win_probability estimates the probability of at least
+    269 votes and its standard error from n_sim simulations drawn
+    in blocks of block_size with a win_units method; corr
+    correlates the states as in simulate_election_totals; n_sim
+    is at least 2. For 'antithetic' n_sim and block_size are
+    rounded up and down to even numbers of simulations (whole
+    pairs); for 'lhs' every block is one replicate, so blocks are
+    at most n_sim // 50 simulations to leave enough replicates
+    for the standard error.
+    returns a WinEstimate"""
+    if rng is None:
+        rng = np.random.default_rng(sim_seed)
+    n_sim = int(n_sim)
+    if n_sim < 2:
+        raise ValueError('n_sim must be at least 2')
+    probs = model[column].values.astype(np.float64)
+    votes = model['Votes'].values.astype(np.float64)
+    chol = None if corr is None else np.linalg.cholesky(corr)
+    tilted = tilted_probs(probs, votes) if method == 'importance' else None
+    if method == 'antithetic':
+        n_sim += n_sim % 2
+        block_size = max(block_size - block_size % 2, 2)
+    elif method == 'lhs':
+        block_size = min(block_size, max(n_sim // 50, 1))
+
+    total = total_sq = 0.0
+    n_units = n_used = 0
+    for start, stop in simulation_blocks(n_sim, block_size):
+        units = win_units(probs, votes, stop - start, rng, method, chol, tilted)
+        total += units.sum()
+        total_sq += np.dot(units, units)
+        n_units += len(units)
+        n_used += 2 * len(units) if method == 'antithetic' else stop - start
+
+    win_prob = total / n_units
+    variance = max(total_sq - n_units * win_prob ** 2, 0) / max(n_units - 1, 1)
+    return WinEstimate(win_prob, np.sqrt(variance / n_units), n_used)
+
+
+def sims_for_precision(estimate, target_se):
+    """sims_for_precision(estimate, target_se)
+    sims_for_precision scales the simulations of a (pilot)
+    WinEstimate to the number expected to reach target_se
+    with the same method (the standard error shrinks with
+    the square root of the simulations), at least 100"""
+    return max(int(np.ceil(estimate.n_sim * (estimate.se / target_se) ** 2)), 100)
+
+
+# number of set bits in each possible byte (for reducing packed wins)
+bit_counts = np.unpackbits(np.arange(256, dtype = np.uint8)[:, np.newaxis],
+                           axis = 1).sum(axis = 1)
+
+
+def packed_state_win_rate(packed, n_sim):
+    """packed_state_win_rate(packed, n_sim)
+    packed_state_win_rate returns the fraction of the
+    n_sim simulations won by each state from the
+    bit-packed wins of simulate_election"""
+    return bit_counts[packed].sum(axis = 1) / int(n_sim)
+
+
+def packed_vote_totals(packed, votes, n_sim, block_size = 100000):
+    """packed_vote_totals(packed, votes, n_sim, block_size = 100000)
+    packed_vote_totals returns the uint16 Electoral College
+    votes of each simulation from the bit-packed wins,
+    unpacking only block_size simulations at a time"""
+    n_sim = int(n_sim)
+    block_size = max(block_size - block_size % 8, 8)
+    totals = np.zeros(n_sim, dtype = np.uint16)
+    for start, stop in simulation_blocks(n_sim, block_size):
+        wins = np.unpackbits(packed[:, start // 8:(stop + 7) // 8], axis = 1)
+        totals[start:stop] = electoral_vote_totals(wins[:, :stop - start], votes)
+    return totals
+
+
+def packed_win_probability(packed, votes, n_sim):
+    """packed_win_probability(packed, votes, n_sim)
+    packed_win_probability returns the fraction of simulations
+    with at least 269 Electoral College votes
+    from the bit-packed wins"""
+    return np.mean(packed_vote_totals(packed, votes, n_sim) >= 269)
+
+
+def packed_state_correlation(packed, n_sim):
+    """packed_state_correlation(packed, n_sim)
+    packed_state_correlation returns the states x states
+    matrix of pairwise correlations of wins, counting joint
+    wins with bitwise and on the packed form (states that
+    always or never win have no defined correlation: NaN)"""
+    n_sim = int(n_sim)
+    wins = bit_counts[packed].sum(axis = 1).astype(np.float64)
+    joint = np.zeros((packed.shape[0], packed.shape[0]))
+    for row in range(packed.shape[0]):
+        joint[row, :] = bit_counts[packed[row] & packed].sum(axis = 1)
+    cov = n_sim * joint - np.outer(wins, wins)
+    var = n_sim * wins - wins ** 2
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return cov / np.sqrt(np.outer(var, var))
+
+
+def exact_distribution(model, column):
+    """exact_distribution(model, column)
+    exact_distribution computes the distribution of
+    Obama Electoral College votes for independent states
+    without sampling: the probability of each total is
+    convolved with one state's votes at a time.
+    returns an ElectionResult"""
+    probs = model[column].values.astype(np.float64)
+    votes = model['Votes'].values.astype(np.int64)
+    pmf = np.zeros(electoral_college_size + 1)
+    pmf[0] = 1
+    for prob, vote in zip(probs, votes):
+        won = pmf[:-vote] * prob
+        pmf *= 1 - prob
+        pmf[vote:] += won
+    return ElectionResult(pmf, state_win_prob = probs)
 
 
 def plot_simulation(vote_totals, n_bins):
     """plot_simulation(vote_totals, n_bins)
     plot_simulation plots the results of the election simulations
-    for n_bins of the distribution of vote toals"""
-    win_sum = pd.Series(np.nansum(vote_totals, axis = 0))
-    win_prob = sum(np.where(win_sum >= 269, 1, 0))/len(win_sum)
+    for n_bins of the distribution of vote toals; vote_totals
+    is an ElectionResult, the states x n_sim vote matrix or the
+    per-simulation totals"""
+    if isinstance(vote_totals, ElectionResult):
+        result = vote_totals
+    else:
+        result = result_from_totals(vote_totals)
     rcParams['figure.figsize'] = (7, 4)
     rcParams['font.size'] = 10
     rcParams['font.family'] = 'Helvetica'
-    spread = \
-      np.abs(np.percentile(win_sum, q = 5) - np.percentile(win_sum, q = 95))
-    win_sum.hist(bins = n_bins)
+    possible = np.flatnonzero(result.counts)
+    plt.hist(possible, bins = n_bins, weights = result.counts[possible])
+    plt.grid(True)
     plt.title('Chance of Obama victory: %f; spread: %d votes; %d bins' % \
-               (win_prob, spread, n_bins))
+               (result.win_prob, result.spread, n_bins))
     plt.xlabel('Obama Electoral College votes')
-    plt.ylabel('Count')
+    plt.ylabel('Count' if result.n_sim is not None else 'Probability')
     plt.axvline(269, color = 'k')
     plt.axvline(332, color = 'r', linestyle = '--')
     plt.legend(['winning threshold', '2012 outcome', 'simulation'], loc = 'best')
@@ -115,18 +758,66 @@ def plot_simulation(vote_totals, n_bins):
 # logistic regression to get probabilities and prediction errors for simulation
 
 
+class FeatureStore(object):
+    """FeatureStore(data_frame, target = 'Winner2008')
+    FeatureStore builds the design matrix once: every numeric
+    column of data_frame in one contiguous float64 array, so
+    a list of predictors resolves to column indices instead of
+    a DataFrame selection and copy for every fit and prediction"""
+
+    def __init__(self, data_frame, target = 'Winner2008'):
+        numeric = data_frame.select_dtypes(include = [np.number])
+        self.index = data_frame.index
+        self.columns = dict((name, idx) for idx, name in enumerate(numeric.columns))
+        self.X = np.ascontiguousarray(numeric.values, dtype = np.float64)
+        self.y = data_frame[target].values
+        self.index_cache = {}
+
+    def indices(self, featureslist):
+        """indices(featureslist)
+        returns the (cached) column indices of featureslist"""
+        key = tuple(featureslist)
+        if key not in self.index_cache:
+            self.index_cache[key] = np.array([self.columns[name] for name in key])
+        return self.index_cache[key]
+
+    def matrix(self, featureslist):
+        """matrix(featureslist)
+        returns the n x len(featureslist) matrix of predictors"""
+        return self.X[:, self.indices(featureslist)]
+
+    def fingerprint(self):
+        """fingerprint()
+        returns a SHA-1 hex digest of the states, columns,
+        design matrix and target"""
+        digest = hashlib.sha1()
+        digest.update(json.dumps([list(map(str, self.index)),
+                                  sorted(self.columns.items())]).encode('utf-8'))
+        digest.update(self.X.tobytes())
+        digest.update(np.ascontiguousarray(self.y).tobytes())
+        return digest.hexdigest()
+
+
 def prepare_features(data_frame, featureslist):
     """prepare_features(data_frame, featureslist)
     prepare_features prepares the features (predictors)
     in featureslist for a logistic regression
-    that will calculate probability of winning.
+    that will calculate probability of winning;
+    data_frame is a DataFrame or a FeatureStore.
     returns matrices y and X (target, coefficient matrix)""" 
+    if isinstance(data_frame, FeatureStore):
+        return data_frame.y, data_frame.matrix(featureslist)
     y = data_frame.Winner2008.values
     X = data_frame[featureslist].values
     if len(X.shape) == 1:
         X = X.reshape(-1, 1)
     return y, X
 
+# solver of every LogisticRegression fit: lbfgs does not penalize the
+# intercept, the objective logistic_newton tunes C for in cv_path
+logistic_solver = 'lbfgs'
+
+
 def fit_logistic(data_frame, featureslist, reg):
     """fit_logistic(data_frame, featureslist, reg)
     fit_logistic fits a logistic model with regularization
@@ -134,28 +825,102 @@ def fit_logistic(data_frame, featureslist, reg):
     and predictors in featureslist.
     returns final DataFrame and classifier"""
     y, X = prepare_features(data_frame, featureslist)
-    clf2 = LogisticRegression(C = reg)
+    clf2 = LogisticRegression(C = reg, solver = logistic_solver)
     clf2.fit(X, y)
-    X_new = data_frame[featureslist]
-    obama_probs = clf2.predict_proba(X_new)[:, 1]
+    obama_probs = clf2.predict_proba(X)[:, 1]
     df = pd.DataFrame(index = data_frame.index)
     df['Obama'] = obama_probs
     return df, clf2
 
-from sklearn.grid_search import GridSearchCV
-
-def cv_optimize(data_frame, featureslist, n_folds, num_p):
-    """cv_optimize(data_frame, featureslist, n_folds, num_p)
+from sklearn.model_selection import GridSearchCV, StratifiedKFold
+
+def stratified_folds(y, n_folds):
+    """stratified_folds(y, n_folds)
+    stratified_folds splits the observations into n_folds
+    folds that keep the class balance, with the same
+    (unshuffled) StratifiedKFold layout GridSearchCV uses
+    for cv = n_folds.
+    returns list of (train, test) index arrays"""
+    return list(StratifiedKFold(n_splits = n_folds).split(np.zeros(len(y)), y))
+
+
+def logistic_newton(X, y, C, coef = None, max_iter = 50, tol = 1e-8):
+    """logistic_newton(X, y, C, coef = None, max_iter = 50, tol = 1e-8)
+    logistic_newton fits the L2-penalized logistic regression
+    0.5 * |w|^2 + C * sum(log loss) with an unpenalized intercept
+    (the lbfgs objective of LogisticRegression) by Newton steps
+    starting from coef ([intercept, w]; zeros if None).
+    Cheap for the 51-row design matrices used here.
+    returns coef"""
+    Z = np.column_stack([np.ones(X.shape[0]), X])
+    penalty = np.ones(Z.shape[1])
+    penalty[0] = 0
+    if coef is None:
+        coef = np.zeros(Z.shape[1])
+
+    def objective(theta):
+        margin = Z.dot(theta)
+        return 0.5 * np.sum(penalty * theta ** 2) + \
+          C * np.sum(np.logaddexp(0, margin) - y * margin)
+
+    current = objective(coef)
+    for iteration in range(max_iter):
+        prob = 1 / (1 + np.exp(-Z.dot(coef)))
+        grad = C * Z.T.dot(prob - y) + penalty * coef
+        hess = C * (Z.T * (prob * (1 - prob))).dot(Z) + np.diag(penalty)
+        step = np.linalg.solve(hess + 1e-10 * np.eye(Z.shape[1]), grad)
+        # backtrack until the objective decreases
+        scale = 1.0
+        while scale > 1e-10:
+            candidate = objective(coef - scale * step)
+            if candidate <= current:
+                break
+            scale /= 2
+        coef = coef - scale * step
+        current = candidate
+        if np.max(np.abs(scale * step)) < tol:
+            break
+    return coef
+
+
+def cv_path(X, y, n_folds, Cs):
+    """cv_path(X, y, n_folds, Cs)
+    cv_path computes the cross-validated accuracy of a logistic
+    regression for every C in Cs (ascending): the folds are split
+    once and, within each fold, the fit for each C is warm-started
+    from the fit for the previous one.
+    returns array of mean accuracy over the folds for each C
+    (unweighted, as the GridSearchCV score)"""
+    folds = stratified_folds(y, n_folds)
+    scores = np.zeros(len(Cs))
+    for train, test in folds:
+        coef = None
+        for idx, C in enumerate(Cs):
+            coef = logistic_newton(X[train], y[train], C, coef = coef)
+            predicted = (coef[0] + X[test].dot(coef[1:]) > 0).astype(y.dtype)
+            scores[idx] += np.mean(predicted == y[test])
+    return scores / len(folds)
+
+
+def cv_optimize(data_frame, featureslist, n_folds, num_p, method = 'path'):
+    """cv_optimize(data_frame, featureslist, n_folds, num_p, method = 'path')
     cv_optimize fits the optimal parameters for the 
     parameters of the logistic function for the data
     in data_frame and predictors in features_list with
     n_folds folds and num_p points in the (log) space 
     for the grid search (C goes from -4 to 3 since
-    the data are scaled).
+    the data are scaled). method = 'path' walks C with
+    warm starts (cv_path); method = 'grid' refits every
+    C and fold from scratch with GridSearchCV.
     returns best parameters and best score"""
     y, X = prepare_features(data_frame, featureslist)
-    clf = LogisticRegression()
-    parameters = {'C':np.logspace(-4, 3, num = num_p)}
+    Cs = np.logspace(-4, 3, num = num_p)
+    if method == 'path':
+        scores = cv_path(X, y, n_folds, Cs)
+        best = np.argmax(scores)
+        return {'C': Cs[best]}, scores[best]
+    clf = LogisticRegression(solver = logistic_solver)
+    parameters = {'C': Cs}
     gs = GridSearchCV(clf, param_grid = parameters, cv = n_folds)
     gs.fit(X, y)
     return gs.best_params_, gs.best_score_
@@ -171,6 +936,205 @@ def cv_and_fit(data_frame, featureslist, n_folds, num_p):
     return predict, clf
 
 
+def fit_cache_key(data_frame, featureslist, n_folds, num_p):
+    """fit_cache_key(data_frame, featureslist, n_folds, num_p)
+    fit_cache_key hashes everything a cv_and_fit result depends on:
+    the data (FeatureStore fingerprint), the predictors,
+    n_folds, num_p, the solver and the scikit-learn version"""
+    if not isinstance(data_frame, FeatureStore):
+        data_frame = FeatureStore(data_frame)
+    key = json.dumps([data_frame.fingerprint(), list(featureslist),
+                      int(n_folds), int(num_p), logistic_solver,
+                      sklearn.__version__])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def evict_fit_cache(cache_dir, max_bytes):
+    """evict_fit_cache(cache_dir, max_bytes)
+    evict_fit_cache removes the least recently used entries
+    of cache_dir until it holds at most max_bytes"""
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if filename.endswith('.pkl'):
+            path = os.path.join(cache_dir, filename)
+            info = os.stat(path)
+            entries.append((info.st_mtime, info.st_size, path))
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # already removed by another worker
+            pass
+        total -= size
+
+
+def cached_cv_and_fit(data_frame, featureslist, n_folds, num_p,
+                      cache_dir = fit_cache_dir, max_bytes = 200 * 2 ** 20):
+    """cached_cv_and_fit(data_frame, featureslist, n_folds, num_p,
+                         cache_dir = fit_cache_dir, max_bytes = 200 * 2 ** 20)
+    cached_cv_and_fit is cv_and_fit with a persistent cache in
+    cache_dir: an entry (best parameters, best score, prediction
+    DataFrame and classifier) is keyed by fit_cache_key and the
+    cache is trimmed to max_bytes, least recently used first.
+    returns the prediction DataFrame and classifer results"""
+    path = os.path.join(cache_dir,
+                        fit_cache_key(data_frame, featureslist, n_folds, num_p) + '.pkl')
+    if os.path.exists(path):
+        with open(path, 'rb') as cache_file:
+            entry = pickle.load(cache_file)
+        # mark as recently used
+        os.utime(path, None)
+        return entry['predict'], entry['classifier']
+
+    bp, bs = cv_optimize(data_frame, featureslist, n_folds = n_folds, num_p = num_p)
+    predict, clf = fit_logistic(data_frame, featureslist, reg = bp['C'])
+    entry = {'params': bp, 'score': bs, 'predict': predict, 'classifier': clf}
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # created by another worker
+            pass
+    # write under a temporary name so readers never see a partial entry
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp_path, 'wb') as cache_file:
+        pickle.dump(entry, cache_file, protocol = pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, path)
+    evict_fit_cache(cache_dir, max_bytes)
+    return predict, clf
+
+
+#------------------------------------------------------------------------------ 
+# batch driver: CV, fit and simulation for every model specification
+
+# one entry of run_models: predictors, prediction DataFrame,
+# fitted classifier and ElectionResult of the simulation
+ModelRun = namedtuple('ModelRun', ['features', 'predict', 'classifier', 'result'])
+
+
+def run_model(task):
+    """run_model(task)
+    run_model performs cv_and_fit and the simulation for one
+    model specification; task is (name, data_frame, featureslist,
+    votes, n_folds, num_p, n_sim, seed_seq, cache_dir, tolerance) as built
+    by run_models.
+    returns name and ModelRun"""
+    name, data_frame, featureslist, votes, n_folds, num_p, n_sim, seed_seq, \
+      cache_dir, tolerance = task
+    if cache_dir is None:
+        predict, clf = cv_and_fit(data_frame, featureslist, n_folds, num_p)
+    else:
+        predict, clf = cached_cv_and_fit(data_frame, featureslist, n_folds, num_p,
+                                         cache_dir = cache_dir)
+    predict['Votes'] = votes
+    if n_sim is None:
+        result = exact_distribution(predict, 'Obama')
+    elif tolerance is not None:
+        result = simulate_election_sequential(predict, 'Obama', tolerance,
+                                              max_sim = n_sim,
+                                              rng = np.random.default_rng(seed_seq))
+    else:
+        totals, state_wins = \
+          simulate_election_totals(predict, n_sim, 'Obama',
+                                   rng = np.random.default_rng(seed_seq))
+        result = result_from_totals(totals)
+        result.state_win_prob = state_wins / int(n_sim)
+    return name, ModelRun(featureslist, predict, clf, result)
+
+
+def run_models(data_frame, model_specs, votes, n_folds, num_p, n_sim = None,
+               n_workers = None, seed = sim_seed, cache_dir = None,
+               tolerance = None):
+    """run_models(data_frame, model_specs, votes, n_folds, num_p, n_sim = None,
+                  n_workers = None, seed = sim_seed, cache_dir = None,
+                  tolerance = None)
+    run_models runs CV, fitting and simulation for every
+    model in model_specs (OrderedDict of name: featureslist)
+    concurrently on a pool of n_workers processes (all cores
+    if None). votes are the Electoral College votes by state;
+    n_sim = None uses exact_distribution, otherwise n_sim
+    simulations are drawn from a stream spawned from seed
+    for each model (with tolerance, sequentially up to n_sim:
+    simulate_election_sequential). With cache_dir, fits are reused from
+    (and saved to) the cached_cv_and_fit cache.
+    returns an OrderedDict of name: ModelRun in model_specs order"""
+    if not model_specs:
+        return OrderedDict()
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    seeds = np.random.SeedSequence(seed).spawn(len(model_specs))
+    tasks = [(name, data_frame, featureslist, votes, n_folds, num_p, n_sim, seed_seq,
+              cache_dir, tolerance)
+             for (name, featureslist), seed_seq in zip(model_specs.items(), seeds)]
+    pool = multiprocessing.Pool(processes = min(n_workers, len(tasks)))
+    try:
+        model_runs = pool.map(run_model, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    return OrderedDict(model_runs)
+
+
+#------------------------------------------------------------------------------ 
+# batch evaluation of the classifiers
+
+
+def classifier_metrics(y, predictions, model_names):
+    """classifier_metrics(y, predictions, model_names)
+    classifier_metrics computes the confusion counts of all
+    models at once from the states x models array of predicted
+    winners (0/1) against the outcomes y, and every score from
+    those counts (scores without predicted or actual wins are 0,
+    as in sklearn).
+    returns DataFrame indexed by model_names with columns
+    tn, fp, fn, tp, accuracy, precision, recall and f1"""
+    actual = np.asarray(y)[:, np.newaxis] == 1
+    predicted = np.asarray(predictions) == 1
+    counts = pd.DataFrame({'tn': (~actual & ~predicted).sum(axis = 0),
+                           'fp': (~actual & predicted).sum(axis = 0),
+                           'fn': (actual & ~predicted).sum(axis = 0),
+                           'tp': (actual & predicted).sum(axis = 0)},
+                          index = model_names, columns = ['tn', 'fp', 'fn', 'tp'])
+    tp, fp, fn = counts.tp.values, counts.fp.values, counts.fn.values
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        counts['accuracy'] = (counts.tp + counts.tn) / len(actual)
+        counts['precision'] = np.nan_to_num(tp / (tp + fp))
+        counts['recall'] = np.nan_to_num(tp / (tp + fn))
+        counts['f1'] = np.nan_to_num(2 * tp / (2 * tp + fp + fn))
+    return counts
+
+
+def classification_report_text(counts):
+    """classification_report_text(counts)
+    classification_report_text formats the per-class precision,
+    recall, f1 score and support of one row of classifier_metrics
+    as sklearn's classification_report.
+    returns str"""
+    tn, fp, fn, tp = counts[['tn', 'fp', 'fn', 'tp']].astype(np.float64)
+    # class 0 is scored with the roles of the counts swapped
+    rows = [(0, tn, fn, fp), (1, tp, fp, fn)]
+    lines = ['%11s%11s%11s%11s%11s' % ('', 'precision', 'recall', 'f1-score',
+                                       'support'), '']
+    scores = []
+    for label, hits, false_alarms, misses in rows:
+        support = hits + misses
+        precision = hits / (hits + false_alarms) if hits + false_alarms else 0.0
+        recall = hits / support if support else 0.0
+        f1 = 2 * hits / (2 * hits + false_alarms + misses) if hits else 0.0
+        scores.append((precision, recall, f1, support))
+        lines.append('%11s%11.2f%11.2f%11.2f%11d' % (label, precision, recall, f1,
+                                                     support))
+    total = sum(score[3] for score in scores)
+    averages = [sum(score[i] * score[3] for score in scores) / total
+                for i in range(3)]
+    lines += ['', '%11s%11.2f%11.2f%11.2f%11d' % (('avg / total',) +
+                                                  tuple(averages) + (total,))]
+    return '\n'.join(lines) + '\n'
+
+
 #------------------------------------------------------------------------------ 
 
 # model predictors
@@ -270,338 +1234,145 @@ model32 = ['pctDollars', 'pop_density.scale', 'census_region_num',
            'male_household.scale', 'one_person_nonfamily.scale',
            'one_person_sixty_five_older.scale', 'one_person_at_least_two.scale']
 
-#------------------------------------------------------------------------------ 
-# prediction, simulation and plotting
-
-predict_model0, class_model0 = cv_and_fit(obama_net_data, model0, 10, 100)
-predict_model0['Votes'] = electoral_votes.Votes
-model0_prob, model0_votes = simulate_election(predict_model0, 1e6+1, 'Obama')
-plot_simulation(model0_votes, 30)
-
-
-predict_model1, class_model1 = cv_and_fit(obama_net_data, model1, 10, 100)
-predict_model1['Votes'] = electoral_votes.Votes
-model1_prob, model1_votes = simulate_election(predict_model1, 1e6+1, 'Obama')
-plot_simulation(model1_votes, 30)
-
-
+# registry of all model specifications (name: predictors)
 
-predict_model2, class_model2 = cv_and_fit(obama_net_data, model2, 10, 100)
-predict_model2['Votes'] = electoral_votes.Votes
-model2_prob, model2_votes = simulate_election(predict_model2, 1e6+1, 'Obama')
-plot_simulation(model2_votes, 30)
+model_specs = OrderedDict(('model%d' % idx, features) for idx, features in
+  enumerate([model0, model1, model2, model3, model4,
+              model5, model6, model7, model8, model9,
+              model10, model11, model12, model13, model14,
+              model15, model16, model17, model18, model19,
+              model20, model21, model22, model23, model24,
+              model25, model26, model27, model28, model29,
+              model30, model31, model32]))
 
+#------------------------------------------------------------------------------ 
+# prediction, simulation and plotting
 
-predict_model3, class_model3 = cv_and_fit(obama_net_data, model3, 10, 100)
-predict_model3['Votes'] = electoral_votes.Votes
-model3_prob, model3_votes = simulate_election(predict_model3, 1e6+1, 'Obama')
-plot_simulation(model3_votes, 30)
-
-
-
-predict_model4, class_model4 = cv_and_fit(obama_net_data, model4, 10, 100)
-predict_model4['Votes'] = electoral_votes.Votes
-model4_prob, model4_votes = simulate_election(predict_model4, 1e6+1, 'Obama')
-plot_simulation(model4_votes, 30)
-
-
-predict_model5, class_model5 = cv_and_fit(obama_net_data, model5, 10, 100)
-predict_model5['Votes'] = electoral_votes.Votes
-model5_prob, model5_votes = simulate_election(predict_model5, 1e6+1, 'Obama')
-plot_simulation(model5_votes, 30)
-
-
-predict_model6, class_model6 = cv_and_fit(obama_net_data, model6, 10, 100)
-predict_model6['Votes'] = electoral_votes.Votes
-model6_prob, model6_votes = simulate_election(predict_model6, 1e6+1, 'Obama')
-plot_simulation(model6_votes, 30)
-
-
-predict_model7, class_model7 = cv_and_fit(obama_net_data, model7, 10, 100)
-predict_model7['Votes'] = electoral_votes.Votes
-model7_prob, model7_votes = simulate_election(predict_model7, 1e6+1, 'Obama')
-plot_simulation(model7_votes, 30)
-
-
-predict_model8, class_model8 = cv_and_fit(obama_net_data, model8, 10, 100)
-predict_model8['Votes'] = electoral_votes.Votes
-model8_prob, model8_votes = simulate_election(predict_model8, 1e6+1, 'Obama')
-plot_simulation(model8_votes, 30)
-
-
-predict_model9, class_model9 = cv_and_fit(obama_net_data, model9, 10, 100)
-predict_model9['Votes'] = electoral_votes.Votes
-model9_prob, model9_votes = simulate_election(predict_model9, 1e6+1, 'Obama')
-plot_simulation(model9_votes, 30)
-
-
-predict_model10, class_model10 = cv_and_fit(obama_net_data, model10, 10, 100)
-predict_model10['Votes'] = electoral_votes.Votes
-model10_prob, model10_votes = simulate_election(predict_model10, 1e6+1, 'Obama')
-plot_simulation(model10_votes, 30)
-
-
-predict_model11, class_model11 = cv_and_fit(obama_net_data, model11, 10, 100)
-predict_model11['Votes'] = electoral_votes.Votes
-model11_prob, model11_votes = simulate_election(predict_model11, 1e6+1, 'Obama')
-plot_simulation(model11_votes, 30)
-
-
-predict_model12, class_model12 = cv_and_fit(obama_net_data, model12, 10, 100)
-predict_model12['Votes'] = electoral_votes.Votes
-model12_prob, model12_votes = simulate_election(predict_model12, 1e6+1, 'Obama')
-plot_simulation(model12_votes, 30)
-
-
-predict_model13, class_model13 = cv_and_fit(obama_net_data, model13, 10, 100)
-predict_model13['Votes'] = electoral_votes.Votes
-model13_prob, model13_votes = simulate_election(predict_model13, 1e6+1, 'Obama')
-plot_simulation(model13_votes, 30)
-
-
-predict_model14, class_model14 = cv_and_fit(obama_net_data, model14, 10, 100)
-predict_model14['Votes'] = electoral_votes.Votes
-model14_prob, model14_votes = simulate_election(predict_model14, 1e6+1, 'Obama')
-plot_simulation(model14_votes, 30)
-
-
-predict_model15, class_model15 = cv_and_fit(obama_net_data, model15, 10, 100)
-predict_model15['Votes'] = electoral_votes.Votes
-model15_prob, model15_votes = simulate_election(predict_model15, 1e6+1, 'Obama')
-plot_simulation(model15_votes, 30)
-
+# the process pools of run_models and simulate_election_parallel import
+# this script again in every worker under the spawn start method (macOS,
+# Windows), so the driver only runs in the main process
+if __name__ == '__main__':
 
-predict_model16, class_model16 = cv_and_fit(obama_net_data, model16, 10, 100)
-predict_model16['Votes'] = electoral_votes.Votes
-model16_prob, model16_votes = simulate_election(predict_model16, 1e6+1, 'Obama')
-plot_simulation(model16_votes, 30)
+    # design matrix shared by all model specifications
+    feature_store = FeatureStore(obama_net_data)
 
+    model_runs = run_models(feature_store, model_specs, electoral_votes.Votes, 10, 100,
+                            cache_dir = fit_cache_dir)
 
-predict_model17, class_model17 = cv_and_fit(obama_net_data, model17, 10, 100)
-predict_model17['Votes'] = electoral_votes.Votes
-model17_prob, model17_votes = simulate_election(predict_model17, 1e6+1, 'Obama')
-plot_simulation(model17_votes, 30)
+    for name in model_runs:
+        plot_simulation(model_runs[name].result, 30)
 
+    # correlated states: national and census region swings
+    # widen the tails of the independent-state distributions
+    state_corr = latent_correlation(obama_net_data.census_region_num.values)
 
-predict_model18, class_model18 = cv_and_fit(obama_net_data, model18, 10, 100)
-predict_model18['Votes'] = electoral_votes.Votes
-model18_prob, model18_votes = simulate_election(predict_model18, 1e6+1, 'Obama')
-plot_simulation(model18_votes, 30)
+    correlated_result = simulate_election_parallel(model_runs['model0'].predict,
+                                                   10 ** 6, 'Obama', corr = state_corr)
 
+    plot_simulation(correlated_result, 30)
 
-predict_model19, class_model19 = cv_and_fit(obama_net_data, model19, 10, 100)
-predict_model19['Votes'] = electoral_votes.Votes
-model19_prob, model19_votes = simulate_election(predict_model19, 1e6+1, 'Obama')
-plot_simulation(model19_votes, 30)
+    # win probability to +/- 0.001 (95%): a pilot run of each variance
+    # reduction method gives the simulations it needs for that precision
+    target_se = 0.001 / 1.96
 
+    pilot_estimates = \
+      OrderedDict((method, estimate_win_probability(model_runs['model0'].predict,
+                                                    10 ** 4, 'Obama', method))
+                  for method in ['plain', 'antithetic', 'lhs', 'importance'])
 
-predict_model20, class_model20 = cv_and_fit(obama_net_data, model20, 10, 100)
-predict_model20['Votes'] = electoral_votes.Votes
-model20_prob, model20_votes = simulate_election(predict_model20, 1e6+1, 'Obama')
-plot_simulation(model20_votes, 30)
+    sims_needed = OrderedDict((method, sims_for_precision(estimate, target_se))
+                              for method, estimate in pilot_estimates.items())
 
+    best_method = min(sims_needed, key = sims_needed.get)
 
-predict_model21, class_model21 = cv_and_fit(obama_net_data, model21, 10, 100)
-predict_model21['Votes'] = electoral_votes.Votes
-model21_prob, model21_votes = simulate_election(predict_model21, 1e6+1, 'Obama')
-plot_simulation(model21_votes, 30)
+    win_estimate = estimate_win_probability(model_runs['model0'].predict,
+                                            sims_needed[best_method], 'Obama',
+                                            best_method)
 
+    # Monte Carlo runs of every model that stop once the win probability is
+    # known to +/- 0.001 (and the spread to 2 votes), up to 1e6 + 1 simulations
+    sequential_runs = run_models(feature_store, model_specs, electoral_votes.Votes, 10, 100,
+                                 n_sim = 10 ** 6 + 1, cache_dir = fit_cache_dir,
+                                 tolerance = 0.001)
 
-predict_model22, class_model22 = cv_and_fit(obama_net_data, model22, 10, 100)
-predict_model22['Votes'] = electoral_votes.Votes
-model22_prob, model22_votes = simulate_election(predict_model22, 1e6+1, 'Obama')
-plot_simulation(model22_votes, 30)
+    sims_used = pd.Series(OrderedDict((name, run.result.n_sim)
+                                      for name, run in sequential_runs.items()))
 
+    # what-if scenarios on one set of draws, e.g. Ohio moving 5 points
+    what_if = WhatIfEngine(model_runs['model0'].predict, 'Obama', n_sim = 10 ** 6)
 
-predict_model23, class_model23 = cv_and_fit(obama_net_data, model23, 10, 100)
-predict_model23['Votes'] = electoral_votes.Votes
-model23_prob, model23_votes = simulate_election(predict_model23, 1e6+1, 'Obama')
-plot_simulation(model23_votes, 30)
+    ohio_plus_five = what_if.what_if({'Ohio': 0.05})
 
+    ohio_sweep = what_if.sweep('Ohio', np.round(np.linspace(-0.2, 0.2, 9), 2))
 
-predict_model24, class_model24 = cv_and_fit(obama_net_data, model24, 10, 100)
-predict_model24['Votes'] = electoral_votes.Votes
-model24_prob, model24_votes = simulate_election(predict_model24, 1e6+1, 'Obama')
-plot_simulation(model24_votes, 30)
 
+    #------------------------------------------------------------------------------ 
+    # confusion matrices, accuracy scores, classification reports
 
-predict_model25, class_model25 = cv_and_fit(obama_net_data, model25, 10, 100)
-predict_model25['Votes'] = electoral_votes.Votes
-model25_prob, model25_votes = simulate_election(predict_model25, 1e6+1, 'Obama')
-plot_simulation(model25_votes, 30)
+    # confusion matrix: predict on classifier, features
 
 
-predict_model26, class_model26 = cv_and_fit(obama_net_data, model26, 10, 100)
-predict_model26['Votes'] = electoral_votes.Votes
-model26_prob, model26_votes = simulate_election(predict_model26, 1e6+1, 'Obama')
-plot_simulation(model26_votes, 30)
+    # predictions of all models stacked into states x models arrays: the
+    # fitted probabilities and the predicted winners (as the classifiers'
+    # predict: probability above 0.5)
 
+    model_names = list(model_runs.keys())
 
-predict_model27, class_model27 = cv_and_fit(obama_net_data, model27, 10, 100)
-predict_model27['Votes'] = electoral_votes.Votes
-model27_prob, model27_votes = simulate_election(predict_model27, 1e6+1, 'Obama')
-plot_simulation(model27_votes, 30)
+    model_list = [run.features for run in model_runs.values()]
 
+    probability_mtx = np.column_stack([run.predict.Obama.values
+                                       for run in model_runs.values()])
 
-predict_model28, class_model28 = cv_and_fit(obama_net_data, model28, 10, 100)
-predict_model28['Votes'] = electoral_votes.Votes
-model28_prob, model28_votes = simulate_election(predict_model28, 1e6+1, 'Obama')
-plot_simulation(model28_votes, 30)
+    model_prediction_mtx = (probability_mtx > 0.5).astype(np.int64)
 
+    results_2012 = obama_net_data.winner_binary
 
-predict_model29, class_model29 = cv_and_fit(obama_net_data, model29, 10, 100)
-predict_model29['Votes'] = electoral_votes.Votes
-model29_prob, model29_votes = simulate_election(predict_model29, 1e6+1, 'Obama')
-plot_simulation(model29_votes, 30)
+    # confusion counts and all scores from one pass over the predictions
+    classifier_scores = classifier_metrics(results_2012.values, model_prediction_mtx,
+                                           model_names)
 
+    # create file with printed output of classifier results
 
-predict_model30, class_model30 = cv_and_fit(obama_net_data, model30, 10, 100)
-predict_model30['Votes'] = electoral_votes.Votes
-model30_prob, model30_votes = simulate_election(predict_model30, 1e6+1, 'Obama')
-plot_simulation(model30_votes, 30)
+    output_dir = \
+     os.path.expanduser('~/GitHub/election-simulations/basic-exploration-python/output/')
 
+    filename = 'obama-net-money-summary'
+    summary_file = open(output_dir + filename + '.class_result', 'w')
 
-predict_model31, class_model31 = cv_and_fit(obama_net_data, model31, 10, 100)
-predict_model31['Votes'] = electoral_votes.Votes
-model31_prob, model31_votes = simulate_election(predict_model31, 1e6+1, 'Obama')
-plot_simulation(model31_votes, 30)
+    summary_file.write('Classifier results for Obama net money'  + '\n')
+    for model_call, (name, scores) in zip(model_list, classifier_scores.iterrows()):
+        print('Predictors: ', str(model_call), '\n', file = summary_file)
+        print('Accuracy: ', scores.accuracy, '\n', file = summary_file)
+        print('Confusion matrix\n',
+              scores[['tn', 'fp', 'fn', 'tp']].values.astype(np.int64).reshape(2, 2), '\n',
+              file = summary_file)
+        print('row = expected, col = predicted', '\n', file = summary_file)
+        print('F1 score: ', scores.f1, '\n', file = summary_file)
+        print('Precision score: ', scores.precision, '\n', file = summary_file)
+        print('Recall score: ', scores.recall, '\n', file = summary_file)
+        print(classification_report_text(scores), '\n', file = summary_file)
+        print('-' * 77, file = summary_file)
 
+    summary_file.close()
 
-predict_model32, class_model32 = cv_and_fit(obama_net_data, model32, 10, 100)
-predict_model32['Votes'] = electoral_votes.Votes
-model32_prob, model32_votes = simulate_election(predict_model32, 1e6+1, 'Obama')
-plot_simulation(model32_votes, 30)
 
+    # DataFrame with prediction results (goes into Google map):
+    # 1.0 where the model predicted the 2012 winner of the state, for all
+    # 51 rows (the former loop stopped at 50 and left the last row at 0)
 
-#------------------------------------------------------------------------------ 
-# confusion matrices, accuracy scores, classification reports
-
-# confusion matrix: predict on classifier, features
-
-
-# writing to summary file:
-# create lists of predictions from classifier
-# loop over predictions and print matrices to summary file
-
-classifier_list = \
-  [class_model0, class_model1, class_model2, class_model3, class_model4,
-   class_model5, class_model6, class_model7, class_model8, class_model9,
-   class_model10, class_model11, class_model12, class_model13, class_model14,
-   class_model15, class_model16, class_model17, class_model18, class_model19,
-   class_model20, class_model21, class_model22, class_model23, class_model24,
-   class_model25, class_model26, class_model27, class_model28, class_model29,
-   class_model30, class_model31, class_model32]
-
-model_list = \
-  [model0, model1, model2, model3, model4,
-   model5, model6, model7, model8, model9,
-   model10, model11, model12, model13, model14,
-   model15, model16, model17, model18, model19,
-   model20, model21, model22, model23, model24,
-   model25, model26, model27, model28, model29,
-   model30, model31, model32]
-  
-classifier_performance_dict = OrderedDict()
-
-# create dict of classifier performance
-for class_result, model_call in zip(classifier_list, model_list):
-    classifier_performance_dict[str(model_call)] = \
-      class_result.predict(obama_net_data[model_call])
-
-
-results_2012 = obama_net_data.winner_binary
-
-# create file with printed output of classifier results
-
-output_dir = \
- os.path.expanduser('~/GitHub/election-simulations/basic-exploration-python/output/')
-
-filename = 'obama-net-money-summary'
-summary_file = open(output_dir + filename + '.class_result', 'w')
-
-summary_file.write('Classifier results for Obama net money'  + '\n')
-for class_result, idx in zip(classifier_performance_dict, xrange(len(classifier_performance_dict))):
-    print >> summary_file, 'Predictors: ', classifier_performance_dict.keys()[idx], '\n'
-    print >> summary_file, 'Accuracy: ' , \
-      accuracy_score(results_2012, classifier_performance_dict[class_result]), '\n'
-    print >> summary_file, 'Confusion matrix\n', \
-      confusion_matrix(results_2012, classifier_performance_dict[class_result]), '\n'
-    print >> summary_file, 'row = expected, col = predicted', '\n'
-    print >> summary_file, 'F1 score: ', \
-      f1_score(results_2012, classifier_performance_dict[class_result]), '\n'
-    print >> summary_file, 'Precision score: ', \
-      precision_score(results_2012, classifier_performance_dict[class_result]), '\n'
-    print >> summary_file, 'Recall score: ', \
-      recall_score(results_2012, classifier_performance_dict[class_result]), '\n'
-    print >> summary_file, \
-      classification_report(results_2012, classifier_performance_dict[class_result]), '\n'
-    print >> summary_file, '-' * 77
-
-summary_file.close()
-
-
-# prediction accuracy
-
-model_prediction_mtx = np.zeros((51, len(classifier_list)))
-
-for col, model, classifier in zip(xrange(51), model_list, classifier_list):
-    model_prediction_mtx[:, col] = classifier.predict(obama_net_data[model])
-   
-# DataFrame with prediction results (goes into Google map)
-
-model_names = \
-  ['model0', 'model1', 'model2', 'model3', 'model4',
-   'model5', 'model6', 'model7', 'model8', 'model9',
-   'model10', 'model11', 'model12', 'model13', 'model14',
-   'model15', 'model16', 'model17', 'model18', 'model19',
-   'model20', 'model21', 'model22', 'model23', 'model24',
-   'model25', 'model26', 'model27', 'model28', 'model29',
-   'model30', 'model31', 'model32']
-    
-classifier_results = \
-  pd.DataFrame(np.zeros((51, len(model_list))), 
-               columns = model_names, index = list(obama_net_data.index.values))
+    classifier_results = \
+      pd.DataFrame((model_prediction_mtx == results_2012.values[:, np.newaxis])
+                   .astype(np.float64),
+                   columns = model_names, index = list(obama_net_data.index.values))
 
+    classifier_results.to_csv(output_dir + 'net-money-classifier-success.csv')
 
-for model, col in zip(model_names, xrange(33)):
-    for ind in xrange(50):
-        if model_prediction_mtx[ind, col] == results_2012[ind]:
-            classifier_results.ix[ind, model] = 1
-        else:
-            classifier_results.ix[ind, model] = 0
-            
-
-classifier_results.to_csv(output_dir + 'net-money-classifier-success.csv')
-
-# DataFrame with classifier probabilities
-
-predict_names = \
-  ['predict_model0', 'predict_model1', 'predict_model2', 'predict_model3',
-   'predict_model4', 'predict_model5', 'predict_model6', 'predict_model7',
-   'predict_model8', 'predict_model9', 'predict_model10', 'predict_model11', 
-   'predict_model12', 'predict_model13', 'predict_model14', 'predict_model15',
-   'predict_model16', 'predict_model17', 'predict_model18', 'predict_model19',
-   'predict_model20', 'predict_model21', 'predict_model22', 'predict_model23',
-   'predict_model24', 'predict_model25', 'predict_model26', 'predict_model27',
-   'predict_model28', 'predict_model29', 'predict_model30', 'predict_model31',
-    'predict_model32']
-  
+    # DataFrame with classifier probabilities
 
-predict_list = \
-  [predict_model0, predict_model1, predict_model2, predict_model3, predict_model4,
-   predict_model5, predict_model6, predict_model7, predict_model8, predict_model9,
-   predict_model10, predict_model11, predict_model12, predict_model13, predict_model14,
-   predict_model15, predict_model16, predict_model17, predict_model18, predict_model19,
-   predict_model20, predict_model21, predict_model22, predict_model23, predict_model24,
-   predict_model25, predict_model26, predict_model27, predict_model28, predict_model29,
-   predict_model30, predict_model31, predict_model32]
-  
-probability_results = \
-  pd.DataFrame(np.zeros((51, len(predict_list))), 
-               columns = predict_names, index = list(obama_net_data.index.values))
+    predict_names = ['predict_' + name for name in model_runs]
 
+    probability_results = \
+      pd.DataFrame(probability_mtx, 
+                   columns = predict_names, index = list(obama_net_data.index.values))
 
-for model, prediction in zip(predict_names, predict_list):
-    probability_results[model] = prediction.Obama.values
-    
-probability_results.to_csv(output_dir + 'net-money-probabilities.csv')
\ No newline at end of file
+    probability_results.to_csv(output_dir + 'net-money-probabilities.csv')
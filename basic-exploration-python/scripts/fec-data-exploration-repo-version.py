@@ -25,30 +25,550 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.pylab as pylab
 import os
+import pickle
+import re
+from collections import OrderedDict
+from pandas.api.types import CategoricalDtype
+
+# typed columnar copies of the exports are optional
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
 
 
 #------------------------------------------------------------------------------ 
-# import data from CSV files
+# ingestion functions
+
+# columns of the FEC file used below and their types
+fec_dtypes = {'cand_nm': object, 'contbr_st': object,
+              'contb_receipt_amt': np.float64, 'contb_receipt_dt': object}
+
+
+def read_fec_chunks(path, states, candidates, chunksize = 100000,
+                    names = None):
+    """read_fec_chunks(path, states, candidates, chunksize = 100000,
+                       names = None)
+    read_fec_chunks streams the FEC file in chunks of chunksize
+    rows, reading only the columns in fec_dtypes, and yields
+    the rows for candidates in states from each chunk, indexed
+    by their row in the file (header excluded, blank lines
+    counted as rows).
+    cand_nm and contbr_st of the kept rows are categoricals
+    with the (sorted) candidates and states as categories.
+    path may be an open file past the header line, whose
+    column names are then given in names.
+    returns generator of DataFrame"""
+    categories = {'cand_nm': CategoricalDtype(sorted(candidates)),
+                  'contbr_st': CategoricalDtype(sorted(states))}
+    for piece in pd.read_csv(path, index_col = False, usecols = list(fec_dtypes),
+                             dtype = fec_dtypes, chunksize = chunksize,
+                             names = names, skip_blank_lines = False,
+                             header = 0 if names is None else None):
+        # rows are filtered on the strings, so that only known values
+        # are converted to the categoricals
+        kept = piece[piece.contbr_st.isin(categories['contbr_st'].categories) &
+                     piece.cand_nm.isin(categories['cand_nm'].categories)]
+        yield kept.astype(categories)
+
+
+def load_fec_data(path, states, candidates, chunksize = 100000,
+                  names = None, first_row = None):
+    """load_fec_data(path, states, candidates, chunksize = 100000,
+                     names = None, first_row = None)
+    load_fec_data reads the rows for candidates in states from
+    the FEC file (see read_fec_chunks); the kept pieces are
+    concatenated once at the end. With first_row, rows keep
+    their position in the file (counting from first_row)
+    as index.
+    returns DataFrame"""
+    pieces = list(read_fec_chunks(path, states, candidates, chunksize, names))
+    if first_row is None:
+        return pd.concat(pieces, ignore_index = True)
+    fec_data = pd.concat(pieces)
+    fec_data.index += first_row
+    return fec_data
+
+
+def map_categories(codes, mapping):
+    """map_categories(codes, mapping)
+    map_categories maps a categorical Series through the dict
+    mapping by translating its few categories once and reusing
+    the integer codes of every row; categories of the result
+    are the sorted values of mapping.
+    returns Categorical"""
+    categories = sorted(set(mapping.values()))
+    lookup = np.array([categories.index(mapping[key]) if key in mapping else -1
+                       for key in codes.cat.categories] + [-1])
+    # code -1 (missing) picks the trailing -1 of lookup
+    return pd.Categorical.from_codes(lookup[codes.cat.codes.values], categories)
+
+
+def parse_fec_dates(dates, date_format = '%d-%b-%y'):
+    """parse_fec_dates(dates, date_format = '%d-%b-%y')
+    parse_fec_dates parses the few distinct date strings of a
+    campaign cycle once and maps them back to every row through
+    their codes; missing dates are NaT and the minimum int32.
+    returns (datetime64 array, int32 array of days since 1970-01-01)"""
+    codes, uniques = pd.factorize(dates)
+    parsed = pd.to_datetime(uniques, format = date_format).values \
+      .astype('datetime64[D]')
+    # code -1 (missing) picks the trailing entry of each table
+    days = np.append(parsed.astype(np.int64), np.iinfo(np.int32).min) \
+      .astype(np.int32)
+    parsed = np.append(parsed, np.datetime64('NaT')).astype('datetime64[ns]')
+    return parsed[codes], days[codes]
+
+
+def clean_fec_data(fec_data, parties, census_regions, economic_regions,
+                   state_names):
+    """clean_fec_data(fec_data, parties, census_regions, economic_regions,
+                      state_names)
+    clean_fec_data adds the party, region and state name
+    columns used for grouping (as categoricals mapped through
+    the dicts) and the receipt date as datetime; all other
+    state attributes stay in state_dim (joined on contbr_st).
+    Called on the rows kept by load_fec_data only.
+    returns DataFrame"""
+    fec_data['party'] = map_categories(fec_data.cand_nm, parties)
+    fec_data['census_region'] = map_categories(fec_data.contbr_st, census_regions)
+    fec_data['economic_region'] = map_categories(fec_data.contbr_st, economic_regions)
+    fec_data['state_name'] = map_categories(fec_data.contbr_st, state_names)
+    # converting date to y-m-d format (and days since 1970-01-01)
+    fec_data['contb_receipt_dt_format'], fec_data['contb_receipt_day'] = \
+      parse_fec_dates(fec_data.contb_receipt_dt)
+    return fec_data
 
-# FEC donations and expenditure data
 
-# file paths have been omitted (2012 FEC dat is on local drive)
+#------------------------------------------------------------------------------ 
+# summary functions
+
+
+# size groups of contributions by absolute amount: (0, 1e2] (including 0),
+# (1e2, 1e3], (1e3, 1e4] and (1e4, 1e5]; larger amounts have no group
+size_edges = np.array([0, 1e2, 1e3, 1e4, 1e5])
+size_labels = ['micro', 'small', 'medium', 'large']
+
+
+def size_buckets(amounts, edges = size_edges, labels = size_labels):
+    """size_buckets(amounts, edges = size_edges, labels = size_labels)
+    size_buckets finds the group of every absolute amount with
+    one binary search over edges; groups are right-closed and
+    the first includes edges[0], as pd.cut with right = True
+    and include_lowest = True.
+    returns Categorical"""
+    values = np.abs(np.asarray(amounts))
+    codes = np.searchsorted(edges, values, side = 'left') - 1
+    codes[values == edges[0]] = 0
+    codes[(codes < 0) | (codes >= len(labels)) | np.isnan(values)] = -1
+    return pd.Categorical.from_codes(codes, labels)
+
+
+def summary_cube_keys(size_column):
+    """summary_cube_keys(size_column)
+    summary_cube_keys declares the group-key combinations
+    summarized for donations and expenditures, with the
+    size groups in size_column (e.g. 'size_bucket').
+    returns OrderedDict of name: keys"""
+    return OrderedDict([
+      ('cand_census', ['cand_nm', 'census_region']),
+      ('cand_economic', ['cand_nm', 'economic_region']),
+      ('cand_state', ['cand_nm', 'contbr_st']),
+      ('cand_size', ['cand_nm', size_column]),
+      ('census_state', ['census_region', 'contbr_st']),
+      ('economic_state', ['economic_region', 'contbr_st']),
+      ('size_state', [size_column, 'contbr_st']),
+      ('size_census', [size_column, 'census_region']),
+      ('size_economic', [size_column, 'economic_region']),
+      ('cand_size_economic', ['cand_nm', size_column, 'economic_region']),
+      ('cand_size_census', ['cand_nm', size_column, 'census_region'])])
+
+
+# grain of the partial sums every summary is rolled up from
+# (regions and day number are functions of state and date)
+fine_keys = ['cand_nm', 'contb_receipt_dt_format', 'contb_receipt_day',
+             'contbr_st', 'census_region', 'economic_region', 'size_bucket']
+
+
+def fine_sums(frame, value = 'contb_receipt_amt'):
+    """fine_sums(frame, value = 'contb_receipt_amt')
+    fine_sums counts the rows of frame and sums value by all
+    fine_keys; rows with a missing key (e.g. no size group)
+    are kept for the summaries that do not group on that key.
+    returns DataFrame (fine_keys, count and value columns)"""
+    return frame.groupby(fine_keys, observed = True, dropna = False) \
+      .agg(count = (value, 'size'), total = (value, 'sum')) \
+      .rename(columns = {'total': value}).reset_index()
+
+
+def merge_fine_sums(pieces, value = 'contb_receipt_amt'):
+    """merge_fine_sums(pieces, value = 'contb_receipt_amt')
+    merge_fine_sums adds up fine_sums of different rows.
+    returns DataFrame (as fine_sums)"""
+    return pd.concat(pieces, ignore_index = True) \
+      .groupby(fine_keys, observed = True, dropna = False)[['count', value]] \
+      .sum().reset_index()
+
+
+def stream_fec_sums(paths, states, candidates, clean, chunksize = 100000,
+                    merge_every = 20):
+    """stream_fec_sums(paths, states, candidates, clean,
+                       chunksize = 100000, merge_every = 20)
+    stream_fec_sums is the out-of-core counterpart of loading
+    the FEC files paths and computing fine_sums of every export
+    source: each chunk is cleaned with clean, cut into size
+    groups and reduced to its fine_sums; partial sums are merged
+    every merge_every chunks, so memory depends on the number of
+    groups rather than on the number of rows.
+    returns OrderedDict of source name: DataFrame (as fine_sums)"""
+    partials = OrderedDict()
+    for path in paths:
+        for chunk in read_fec_chunks(path, states, candidates, chunksize):
+            chunk = clean(chunk.copy())
+            chunk['size_bucket'] = size_buckets(chunk.contb_receipt_amt)
+            for source, frame in export_sources(chunk).items():
+                pieces = partials.setdefault(source, [])
+                pieces.append(fine_sums(frame))
+                if len(pieces) >= merge_every:
+                    pieces[:] = [merge_fine_sums(pieces)]
+    return OrderedDict((source, merge_fine_sums(pieces))
+                       for source, pieces in partials.items())
+
+
+def summary_cubes(sums, cube_keys, value = 'contb_receipt_amt'):
+    """summary_cubes(sums, cube_keys, value = 'contb_receipt_amt')
+    summary_cubes rolls up the count and sum of value for every
+    group-key combination in cube_keys (name: keys) from sums,
+    the fine_sums of the rows summarized.
+    returns dict of name: DataFrame indexed by keys
+    with columns count and sum"""
+    return dict((name, sums.groupby(list(keys), observed = True)[['count', value]]
+                 .sum().rename(columns = {value: 'sum'}))
+                for name, keys in cube_keys.items())
+
+
+def daily_cube(frame, size_column, state_dim,
+               regions = ['census_region', 'economic_region'],
+               value = 'contb_receipt_amt'):
+    """daily_cube(frame, size_column, state_dim,
+                  regions = ['census_region', 'economic_region'],
+                  value = 'contb_receipt_amt')
+    daily_cube adds up count and value of frame (fine_sums) into
+    dense arrays indexed [day, candidate, state, size], one day
+    per calendar day from the first to the last receipt; the last
+    slot of each key axis holds rows with a missing key, while rows
+    without a receipt date (see parse_fec_dates) are left out. regions
+    (columns of state_dim) are kept as a state: region map and
+    rolled up from the state axis by cube_series.
+    returns dict with days (DatetimeIndex), axes (OrderedDict of
+    key: categories), regions (dict of region: Series by state),
+    count and sum (arrays)"""
+    frame = frame[frame.contb_receipt_dt_format.notnull()]
+    first_day = frame.contb_receipt_day.min()
+    n_days = frame.contb_receipt_day.max() - first_day + 1
+    axes = OrderedDict((key, frame[key].cat.categories)
+                       for key in ['cand_nm', 'contbr_st', size_column])
+    shape = (n_days,) + tuple(len(categories) + 1 for categories in axes.values())
+    cells = frame.contb_receipt_day.values.astype(np.int64) - first_day
+    for size, key in zip(shape[1:], axes):
+        codes = frame[key].cat.codes.values
+        cells = cells * size + np.where(codes < 0, size - 1, codes)
+    n_cells = int(np.prod(shape))
+    return {'days': pd.date_range(pd.to_datetime(first_day, unit = 'D'),
+                                  periods = n_days,
+                                  name = 'contb_receipt_dt_format'),
+            'axes': axes,
+            'regions': dict((region, state_dim[region].reindex(axes['contbr_st']))
+                            for region in regions),
+            'count': np.bincount(cells, weights = frame['count'].values,
+                                 minlength = n_cells).astype(np.int64).reshape(shape),
+            'sum': np.bincount(cells, weights = frame[value].values,
+                               minlength = n_cells).reshape(shape)}
+
+
+def cube_series(cube, key, start = None, end = None, value = 'count'):
+    """cube_series(cube, key, start = None, end = None, value = 'count')
+    cube_series slices the days start to end (dates or partial
+    date strings, both inclusive) of a daily_cube and sums value
+    over all axes but key (an axis or one of the regions); rows
+    with a missing key are left out.
+    returns DataFrame indexed by day with one column per key value"""
+    window = cube['days'].slice_indexer(start, end)
+    axes = list(cube['axes'])
+    axis = 1 + axes.index('contbr_st' if key in cube['regions'] else key)
+    other_axes = tuple(i for i in range(1, len(axes) + 1) if i != axis)
+    totals = cube[value][window].sum(axis = other_axes)[:, :-1]
+    days = cube['days'][window]
+    if key in cube['regions']:
+        by_state = pd.DataFrame(totals, index = days,
+                                columns = cube['regions'][key].values)
+        # states without a region are dropped
+        return by_state.T.groupby(level = 0, observed = True).sum().T \
+          .rename_axis(key, axis = 1)
+    return pd.DataFrame(totals, index = days,
+                        columns = pd.Index(cube['axes'][key], name = key))
+
+
+# finest aggregation of the exports: candidate, date and state
+export_base_keys = ['cand_nm', 'contb_receipt_dt_format', 'contbr_st']
+
+
+def export_sums(sources, export_specs, state_dim, value = 'contb_receipt_amt',
+                base_sums = None):
+    """export_sums(sources, export_specs, state_dim, value = 'contb_receipt_amt',
+                   base_sums = None)
+    export_sums computes the sums of value requested in export_specs
+    (name: (source, keys)); sources maps source names to frames.
+    Each distinct (source, keys) aggregation is computed once and
+    every source is grouped only once, on export_base_keys; keys
+    that are state attributes (columns of state_dim) are joined
+    onto that small result afterwards, and coarser keys are
+    rolled up from it. Like a groupby on the attributes, states
+    with missing attributes are dropped. base_sums maps source
+    names to their export_base_keys sums when these are already
+    known (e.g. kept up to date by update_fec_store).
+    returns OrderedDict of name: DataFrame (keys + value columns)"""
+    computed = dict(((source, tuple(export_base_keys)), sums)
+                    for source, sums in (base_sums or {}).items())
+
+    def aggregate(source, keys):
+        node = (source, tuple(keys))
+        if node in computed:
+            return computed[node]
+        if list(keys) == export_base_keys:
+            result = sources[source].groupby(export_base_keys, as_index = False,
+                                             observed = True)[[value]].sum()
+        else:
+            base = aggregate(source, export_base_keys)
+            attributes = [key for key in keys if key not in export_base_keys]
+            if attributes:
+                base = base.join(state_dim[attributes], on = 'contbr_st') \
+                  .dropna(subset = attributes)
+            if set(export_base_keys) <= set(keys):
+                # same grain as the base: attach attributes only
+                result = base.sort_values([key for key in keys
+                                           if key in export_base_keys])
+            else:
+                result = base.groupby(list(keys), as_index = False,
+                                      observed = True)[[value]].sum()
+            result = result[list(keys) + [value]].reset_index(drop = True)
+        computed[node] = result
+        return result
+
+    return OrderedDict((name, aggregate(source, keys))
+                       for name, (source, keys) in export_specs.items())
+
+
+def write_export(frame, filename):
+    """write_export(frame, filename)
+    write_export writes frame to the CSV file filename and, when
+    pyarrow is installed, a Feather copy next to it (same name,
+    .feather extension) that keeps the datetime and categorical
+    column types; R and Python read the copy memory-mapped.
+    returns None"""
+    frame.to_csv(filename)
+    if feather is not None:
+        feather.write_feather(frame.reset_index(drop = True),
+                              os.path.splitext(filename)[0] + '.feather')
+
+
+#------------------------------------------------------------------------------ 
+# FEC store functions
+
+# the store keeps the cleaned FEC rows in one pickle per month and
+# candidate (<store_dir>/<YYYY-MM>/<candidate>.pkl, rows without a receipt
+# date under <store_dir>/unknown) and, in its
+# manifest, the byte offset and row count ingested from the raw file,
+# and the export_base_keys sums and fine_sums (cut at size_edges) of
+# every export source
+
+
+def export_sources(fec_final):
+    """export_sources(fec_final)
+    export_sources splits the FEC data into the frames the
+    exports are computed from: all rows, donations (positive
+    amounts) and expenditures (negative amounts).
+    returns OrderedDict of name: DataFrame"""
+    return OrderedDict([
+      ('fec_final', fec_final),
+      ('donations', fec_final[fec_final.contb_receipt_amt > 0]),
+      ('expenditures', fec_final[fec_final.contb_receipt_amt < 0])])
+
+
+class FileRange(object):
+    """FileRange(handle, end)
+    FileRange reads an open binary file up to byte end, so
+    that a line still being appended is left for later, and
+    counts the lines read. The file must hold one record per
+    line: a line break inside a quoted field (an odd number of
+    quotes before it) raises a ValueError, as the line count
+    would no longer be the record count.
+    """
+    def __init__(self, handle, end):
+        self.handle = handle
+        self.end = end
+        self.lines = 0
+        self.in_quotes = False
+
+    def read(self, size = -1):
+        remaining = self.end - self.handle.tell()
+        if size < 0 or size > remaining:
+            size = remaining
+        data = self.handle.read(size)
+        chars = np.frombuffer(data, dtype = np.uint8)
+        # quote parity after every byte, carried over from the last read
+        quoted = (np.cumsum(chars == ord('"')) + self.in_quotes) % 2 == 1
+        breaks = chars == ord('\n')
+        if quoted[breaks].any():
+            raise ValueError('line break in a quoted field: '
+                             'one record per line expected')
+        if len(data):
+            self.in_quotes = bool(quoted[-1])
+        self.lines += int(breaks.sum())
+        return data
+
+
+def read_fec_manifest(store_dir):
+    """read_fec_manifest(store_dir)
+    read_fec_manifest reads the manifest of the FEC store in
+    store_dir; an empty store has no header and offset 0.
+    returns dict"""
+    path = os.path.join(store_dir, 'manifest.pkl')
+    if not os.path.exists(path):
+        return {'header': None, 'offset': 0, 'rows': 0, 'partitions': [],
+                'base_sums': OrderedDict(), 'fine_sums': OrderedDict(),
+                'size_edges': size_edges}
+    with open(path, 'rb') as manifest_file:
+        return pickle.load(manifest_file)
+
+
+def clear_fec_store(store_dir, manifest):
+    """clear_fec_store(store_dir, manifest)
+    clear_fec_store deletes the manifest of the FEC store in
+    store_dir and the partitions it lists (and month directories
+    left empty); other files in store_dir are kept.
+    returns None"""
+    for name in manifest['partitions'] + ['manifest.pkl']:
+        path = os.path.join(store_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+        month_dir = os.path.dirname(path)
+        if month_dir != store_dir and os.path.isdir(month_dir) and \
+          not os.listdir(month_dir):
+            os.rmdir(month_dir)
+
+
+def update_fec_store(path, store_dir, states, candidates, clean,
+                     chunksize = 100000):
+    """update_fec_store(path, store_dir, states, candidates, clean,
+                        chunksize = 100000)
+    update_fec_store ingests the complete lines appended to the
+    FEC file path since the last update (load_fec_data from the
+    stored byte offset), cleans them with clean, appends them to
+    their month/candidate partitions and adds their sums to the
+    stored export base sums and fine_sums. The store is rebuilt
+    when path is shorter than the offset, its header changed (a
+    new file) or size_edges changed since the fine_sums were cut.
+    Rows are indexed by their line in path, so an update that
+    stopped before writing the manifest is redone without
+    duplicating rows in the partitions; path must therefore hold
+    one record per line (see FileRange; blank lines are read as
+    empty rows and dropped).
+    returns dict (the manifest)"""
+    manifest = read_fec_manifest(store_dir)
+    with open(path, 'rb') as fec_file:
+        header = fec_file.readline()
+        # end of the last complete line
+        fec_file.seek(0, os.SEEK_END)
+        end = fec_file.tell()
+        fec_file.seek(max(end - 2**16, len(header)))
+        tail = fec_file.read()
+        end -= len(tail) - tail.rfind(b'\n') - 1
+        if header != manifest['header'] or end < manifest['offset'] or \
+          not np.array_equal(manifest.get('size_edges'), size_edges):
+            clear_fec_store(store_dir, manifest)
+            manifest = read_fec_manifest(store_dir)
+            manifest['header'] = header
+            manifest['offset'] = len(header)
+        if end <= manifest['offset']:
+            return manifest
+        fec_file.seek(manifest['offset'])
+        new_lines = FileRange(fec_file, end)
+        names = header.decode('utf-8').strip().split(',')
+        new_rows = clean(load_fec_data(new_lines, states, candidates, chunksize,
+                                       names = names,
+                                       first_row = manifest['rows']))
+    # rows without a date are kept in the unknown partitions (and in the
+    # fine_sums) but left out of the base sums, which group on the date
+    months = new_rows.contb_receipt_dt_format.dt.strftime('%Y-%m') \
+      .fillna('unknown')
+    for (month, candidate), rows in new_rows.groupby([months, 'cand_nm'],
+                                                     observed = True):
+        name = os.path.join(month, re.sub('[^a-z]+', '-', candidate.lower())
+                            .strip('-') + '.pkl')
+        partition = os.path.join(store_dir, name)
+        if os.path.exists(partition):
+            rows = pd.concat([pd.read_pickle(partition), rows])
+            rows = rows[~rows.index.duplicated(keep = 'last')]
+        elif not os.path.isdir(os.path.dirname(partition)):
+            os.makedirs(os.path.dirname(partition))
+        if name not in manifest['partitions']:
+            manifest['partitions'].append(name)
+        rows.to_pickle(partition)
+    # new sums are added to the stored ones (size groups are cut for the
+    # fine_sums only, the partitions keep the cleaned rows)
+    new_rows['size_bucket'] = size_buckets(new_rows.contb_receipt_amt)
+    for source, frame in export_sources(new_rows).items():
+        new_sums = export_sums({source: frame},
+                               {source: (source, export_base_keys)}, None)[source]
+        new_fine = fine_sums(frame)
+        if source in manifest['base_sums']:
+            new_sums = pd.concat([manifest['base_sums'][source], new_sums]) \
+              .groupby(export_base_keys, as_index = False, observed = True).sum()
+            new_fine = merge_fine_sums([manifest['fine_sums'][source], new_fine])
+        manifest['base_sums'][source] = new_sums
+        manifest['fine_sums'][source] = new_fine
+    manifest['offset'] = end
+    manifest['rows'] += new_lines.lines
+    manifest['partitions'].sort()
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    with open(os.path.join(store_dir, 'manifest.pkl'), 'wb') as manifest_file:
+        pickle.dump(manifest, manifest_file, pickle.HIGHEST_PROTOCOL)
+    return manifest
+
+
+def read_fec_store(store_dir):
+    """read_fec_store(store_dir)
+    read_fec_store reads all partitions of the FEC store in
+    store_dir back into one frame, rows in file order; an empty
+    store gives an empty frame with the fec_dtypes columns.
+    returns DataFrame"""
+    manifest = read_fec_manifest(store_dir)
+    if not manifest['partitions']:
+        return pd.DataFrame(columns = list(fec_dtypes))
+    return pd.concat([pd.read_pickle(os.path.join(store_dir, name))
+                      for name in manifest['partitions']]) \
+      .sort_index().reset_index(drop = True)
 
-fec_data_head = \
-  pd.read_csv('P00000001-ALL.csv',  index_col = False, nrows = 10)
-fec_data_cols = fec_data_head.columns.values.tolist()
 
-fec_chunker = \
-  pd.read_csv('/P00000001-ALL.csv', index_col = False, low_memory = False, 
-              chunksize = 100000)
+#------------------------------------------------------------------------------ 
+# import data from CSV files
 
-fec_data = pd.DataFrame()
+# FEC donations and expenditure data: read after the dicts below
+# (load_fec_data filters on states and candidates while reading)
+
+# file paths have been omitted (2012 FEC dat is on local drive)
 
-for piece in fec_chunker:
-    fec_data = fec_data.append(piece)
+fec_file = 'P00000001-ALL.csv'
 
-fec_data.shape
-fec_data.head()
+# cleaned FEC data, by month and candidate (see update_fec_store)
+fec_store_dir = 'fec-store'
+
+# out-of-core mode: stream fec_files (e.g. several cycles) and keep only
+# their partial sums (see stream_fec_sums) instead of loading every row
+out_of_core = False
+fec_files = [fec_file]
 
 # 2010 census data;
 # already downloaded to local drive
@@ -134,8 +654,24 @@ state_votes = {'CT': 7, 'ME': 4, 'MA': 11,'NH': 4, 'RI': 4, 'VT': 3,
                   'TX':38, 'AZ':11, 'CO':9, 'ID':4, 'MT':3, 'NV':6, 'NM':5, 'UT':6, 
                   'WY':3, 'AK':3,'CA':55, 'HI':4, 'OR':7, 'WA':12}
 
-
-# population by state (2010 census), votes and winner (mapped to fec_data)
+# restrict to obama and romney and 50 states + DC
+states = census_regions.keys()
+candidates = ['Obama, Barack', 'Romney, Mitt']
+
+# FEC data, filtered while reading and cleaned (see clean_fec_data)
+clean_rows = lambda rows: clean_fec_data(rows, parties, census_regions,
+                                         economic_regions, state_names)
+
+if out_of_core:
+    fec_sums = stream_fec_sums(fec_files, states, candidates, clean_rows)
+else:
+    # only the lines appended to fec_file since the last run are read
+    # into the store
+    fec_manifest = update_fec_store(fec_file, fec_store_dir, states,
+                                    candidates, clean_rows)
+    fec_sums = fec_manifest['fine_sums']
+
+# population by state (2010 census), votes and winner (joined into state_dim)
 population_data = \
   population_data[population_data.STATE_OR_REGION.isin(state_names.values())]
 
@@ -154,243 +690,88 @@ elderly_population_data.set_index(elderly_population_data.State, \
 family_population_data.set_index(family_population_data.State, \
                                  inplace = True, drop = True)
 
-# isolating 2010 population results
-state_pop_dict = {}
-
-for state in population_data.STATE_OR_REGION:
-    state_pop_dict[state] = population_data.loc[state, '2010_POPULATION']
-    
-state_density_dict = {}
-
-for state in population_data.STATE_OR_REGION:
-    state_density_dict[state] = population_data.loc[state, '2010_DENSITY']
-    
-# mapping vote totals and winners to states
-obama_vote_dict = {}
-romney_vote_dict = {}
-winner_dict = {}
-
-vote_total.set_index(vote_total.State, inplace = True, drop = True)
-
-for state in vote_total.State:
-    obama_vote_dict[state] = vote_total.loc[state, 'Obama']
- 
-for state in vote_total.State:
-    romney_vote_dict[state] = vote_total.loc[state, 'Romney']
-
-for state in vote_total.State:
-    winner_dict[state] = vote_total.loc[state, 'Winner']
-    
-# mapping population demographics to states
-
-# creating dicts
-male_pop = {}
-female_pop = {}
-sex_ratio = {}
-under_18_count = {}
-under_18_pct = {}
-eighteen_to_forty_four_count = {}
-eighteen_to_forty_four_pct = {}
-forty_five_to_sixty_four_count = {}
-forty_five_to_sixty_four_pct = {}
-sixty_five_over_count = {}
-sixty_five_over_pct = {}
-median_age = {}
-
-eighty_five_over_count = {}
-eighty_five_over_pct = {}
-
-total_households = {}
-husband_wife = {}
-husband_wife_child_under_18 = {}
-female_household = {}
-female_household_child_under_18 = {}
-male_household = {}
-male_household_child_under_18 = {}
-one_person_non_family = {}
-one_person_sixty_five_older = {}
-one_person_at_least_two = {}
-avg_per_household = {}
-avg_per_family = {}
-
-# putting state values in dicts
-for state in state_population_data.State:
-    male_pop[state] = state_population_data.loc[state, 'Male']
-    
-for state in state_population_data.State:
-    female_pop[state] = state_population_data.loc[state, 'Female']
-
-for state in state_population_data.State:
-    sex_ratio[state] = state_population_data.loc[state, 'SexRatio']
-
-for state in state_population_data.State:
-    under_18_count[state] = state_population_data.loc[state, 'Under18Count']
-
-for state in state_population_data.State:
-    under_18_pct[state] = state_population_data.loc[state, 'Under18Pct']
-
-for state in state_population_data.State:
-    eighteen_to_forty_four_count[state] = \
-    state_population_data.loc[state, 'EighteentoFortyFourCount']
-
-for state in state_population_data.State:
-    eighteen_to_forty_four_pct[state] = \
-    state_population_data.loc[state, 'EighteentoFortyFourPct']
-
-for state in state_population_data.State:
-    forty_five_to_sixty_four_count[state] = \
-    state_population_data.loc[state, 'FortyFivetoSixtyFourCount']
-
-for state in state_population_data.State:
-    forty_five_to_sixty_four_pct[state] = \
-    state_population_data.loc[state, 'FortyFivetoSixtyFourPct']
-    
-for state in state_population_data.State:
-    sixty_five_over_count[state] = \
-    state_population_data.loc[state, 'SixtyFiveOverCount']
-    
-for state in state_population_data.State:
-    sixty_five_over_pct[state] = \
-    state_population_data.loc[state, 'SixtyFiveOverPct']
-
-for state in state_population_data.State:
-    median_age[state] = state_population_data.loc[state, 'MedianAge']
-    
-for state in elderly_population_data.State:
-    eighty_five_over_count[state] = \
-    elderly_population_data.loc[state, 'EightyFiveOverCount']
-
-for state in elderly_population_data.State:
-    eighty_five_over_pct[state] = \
-    elderly_population_data.loc[state, 'EightyFiveOverPct']    
-
-for state in family_population_data.State:
-    total_households[state] = family_population_data.loc[state, 'TotalHouseholds']
-
-for state in family_population_data.State:
-    husband_wife[state] = family_population_data.loc[state, 'HusbandWifeHousehold']
-
-for state in family_population_data.State:
-    husband_wife_child_under_18[state] = \
-    family_population_data.loc[state, 'HusbandWifeUnder18Children']
-    
-for state in family_population_data.State:
-    female_household[state] = family_population_data.loc[state, 'FemaleHousehold']
-
-for state in family_population_data.State:
-    female_household_child_under_18[state] = \
-    family_population_data.loc[state, 'FemaleHouseholdUnder18']
-
-for state in family_population_data.State:
-    male_household[state] = \
-    family_population_data.loc[state, 'MaleHousehold']
-
-for state in family_population_data.State:
-    male_household_child_under_18[state] = \
-    family_population_data.loc[state, 'MaleHouseholdUnder18']
-
-
-for state in family_population_data.State:
-    one_person_non_family[state] = \
-    family_population_data.loc[state, 'OnePersonNonFamily']
-
-for state in family_population_data.State:
-    one_person_sixty_five_older[state] = \
-    family_population_data.loc[state, 'OnePersonSixtyFiveOlder']
-
-for state in family_population_data.State:
-    one_person_at_least_two[state] = \
-    family_population_data.loc[state, 'OnePersonTwoOrMore']
-
-for state in family_population_data.State:
-    avg_per_household[state] = family_population_data.loc[state, 'AvgPerHousehold']
-
-for state in family_population_data.State:
-    avg_per_family[state] = family_population_data.loc[state, 'AvgPerFamily']
-
-#------------------------------------------------------------------------------ 
-# mapping data using above dictionaries (new columns created)
-         
-fec_data['party'] = fec_data.cand_nm.map(parties)
-fec_data['census_region'] = fec_data.contbr_st.map(census_regions)
-fec_data['economic_region'] = fec_data.contbr_st.map(economic_regions)
-fec_data['state_name'] = fec_data.contbr_st.map(state_names)
-fec_data['electoral_votes'] = fec_data.contbr_st.map(state_votes)
-fec_data['population'] = fec_data.state_name.map(state_pop_dict)
-fec_data['pop_density'] = fec_data.state_name.map(state_density_dict)
-fec_data['winner'] = fec_data.contbr_st.map(winner_dict)
-fec_data['obama_total'] = fec_data.contbr_st.map(obama_vote_dict)
-fec_data['romney_total'] = fec_data.contbr_st.map(romney_vote_dict)
-
-fec_data['males'] = fec_data.state_name.map(male_pop)
-fec_data['females'] = fec_data.state_name.map(female_pop)
-fec_data['sex_ratio'] = fec_data.state_name.map(sex_ratio)
-fec_data['under_18_count'] = fec_data.state_name.map(under_18_count)
-fec_data['under_18_pct'] = fec_data.state_name.map(under_18_pct)
-fec_data['eighteen_to_forty_four_count'] = fec_data.state_name.map(eighteen_to_forty_four_count)
-fec_data['eighteen_to_forty_four_pct'] = fec_data.state_name.map(eighteen_to_forty_four_pct)
-fec_data['forty_five_to_sixty_four_count'] = fec_data.state_name.map(forty_five_to_sixty_four_count)
-fec_data['forty_five_to_sixty_four_pct'] = fec_data.state_name.map(forty_five_to_sixty_four_pct)
-fec_data['sixty_five_over_count'] = fec_data.state_name.map(sixty_five_over_count)
-fec_data['sixty_five_over_pct'] = fec_data.state_name.map(sixty_five_over_pct)
-fec_data['median_age'] = fec_data.state_name.map(median_age)
-
-fec_data['total_households'] = fec_data.state_name.map(total_households)
-fec_data['husband_wife_household'] = fec_data.state_name.map(husband_wife)
-fec_data['husband_wife_child_under_18'] = fec_data.state_name.map(husband_wife_child_under_18)
-fec_data['female_household'] = fec_data.state_name.map(female_household)
-fec_data['female_child_under_18'] = fec_data.state_name.map(female_household_child_under_18)
-fec_data['male_household'] = fec_data.state_name.map(male_household)
-fec_data['male_child_under_18'] = fec_data.state_name.map(male_household_child_under_18)
-fec_data['one_person_nonfamily'] = fec_data.state_name.map(one_person_non_family)
-fec_data['one_person_sixty_five_older'] = fec_data.state_name.map(one_person_sixty_five_older)
-fec_data['one_person_at_least_two'] = fec_data.state_name.map(one_person_at_least_two)
-fec_data['avg_per_family'] = fec_data.state_name.map(avg_per_family)
-fec_data['avg_per_household'] = fec_data.state_name.map(avg_per_household)
-
-fec_data['eighty_five_over_count'] = fec_data.state_name.map(eighty_five_over_count)
-fec_data['eighty_five_over_pct'] = fec_data.state_name.map(eighty_five_over_pct)
-
-
-
-# converting date to y-m-d format
-fec_data['contb_receipt_dt_format'] = \
-  pd.to_datetime(fec_data.contb_receipt_dt, format = '%d-%b-%y')
+# state dimension table: one row per state (index = contbr_st) with
+# the 2010 census, vote and electoral college attributes; joined to
+# contribution summaries after aggregation instead of mapped onto
+# every contribution row
+
+# source column: state dimension column
+population_columns = {'2010_POPULATION': 'population', '2010_DENSITY': 'pop_density'}
+
+vote_columns = {'Winner': 'winner', 'Obama': 'obama_total', 'Romney': 'romney_total'}
+
+census_columns = \
+  {'Male': 'males', 'Female': 'females', 'SexRatio': 'sex_ratio',
+   'Under18Count': 'under_18_count', 'Under18Pct': 'under_18_pct',
+   'EighteentoFortyFourCount': 'eighteen_to_forty_four_count',
+   'EighteentoFortyFourPct': 'eighteen_to_forty_four_pct',
+   'FortyFivetoSixtyFourCount': 'forty_five_to_sixty_four_count',
+   'FortyFivetoSixtyFourPct': 'forty_five_to_sixty_four_pct',
+   'SixtyFiveOverCount': 'sixty_five_over_count',
+   'SixtyFiveOverPct': 'sixty_five_over_pct', 'MedianAge': 'median_age'}
+
+elderly_columns = {'EightyFiveOverCount': 'eighty_five_over_count',
+                   'EightyFiveOverPct': 'eighty_five_over_pct'}
+
+family_columns = \
+  {'TotalHouseholds': 'total_households',
+   'HusbandWifeHousehold': 'husband_wife_household',
+   'HusbandWifeUnder18Children': 'husband_wife_child_under_18',
+   'FemaleHousehold': 'female_household',
+   'FemaleHouseholdUnder18': 'female_child_under_18',
+   'MaleHousehold': 'male_household',
+   'MaleHouseholdUnder18': 'male_child_under_18',
+   'OnePersonNonFamily': 'one_person_nonfamily',
+   'OnePersonSixtyFiveOlder': 'one_person_sixty_five_older',
+   'OnePersonTwoOrMore': 'one_person_at_least_two',
+   'AvgPerHousehold': 'avg_per_household', 'AvgPerFamily': 'avg_per_family'}
+
+state_dim = pd.DataFrame({'state_name': pd.Series(state_names),
+                          'census_region': pd.Series(census_regions),
+                          'economic_region': pd.Series(economic_regions),
+                          'electoral_votes': pd.Series(state_votes)})
+state_dim.index.name = 'contbr_st'
+
+# vote totals are indexed by state abbreviation, census data by state name
+state_dim = \
+  state_dim.join(vote_total[list(vote_columns)].rename(columns = vote_columns))
+
+for census_data, columns in [(population_data, population_columns),
+                             (state_population_data, census_columns),
+                             (elderly_population_data, elderly_columns),
+                             (family_population_data, family_columns)]:
+    state_dim = state_dim.join(census_data[list(columns)].rename(columns = columns),
+                               on = 'state_name')
+
+state_dim['winner'] = state_dim.winner.astype('category')
 
 #------------------------------------------------------------------------------ 
 # create final datasets
 
-# restrict to obama and romney and 50 states + DC
-states = census_regions.keys()
-fec_final = fec_data[fec_data.contbr_st.isin(states)]
-fec_final = fec_final[fec_final.cand_nm.isin(['Obama, Barack','Romney, Mitt'])]
-
-
 # free up memory
-del fec_data 
 del population_data
 
-# donation data (positive amounts)
-donations = fec_final[fec_final.contb_receipt_amt > 0]
-
-# expenditures (negative amounts)
-expenditures = fec_final[fec_final.contb_receipt_amt < 0]
+# all summaries below are rolled up from the partial sums in fec_sums
+# (kept up to date by update_fec_store, or streamed by stream_fec_sums);
+# the cleaned rows themselves stay on disk (see read_fec_store)
 
 
 #------------------------------------------------------------------------------ 
 # donation summary statistics
 
-# cut into discrete groups based on amount contributed
-donations['donor_size'] = \
-pd.cut(donations.loc[:,'contb_receipt_amt'], right = True, include_lowest = True,
-       bins = np.array([0, 1e2, 1e3, 1e4, 1e5]),
-       labels = np.array(['micro', 'small', 'medium', 'large']))
+# discrete groups based on amount contributed: size_bucket
 
 # summaries and plots for each group and interaction
 
+# counts and sums for all groups in one pass
+donation_cubes = summary_cubes(fec_sums['donations'], summary_cube_keys('size_bucket'))
+
+# daily counts and sums for the time series plots
+donation_daily = daily_cube(fec_sums['donations'], 'size_bucket', state_dim)
+
 # by census region
 cand_census_size = \
-  donations.groupby(['cand_nm', 'census_region']).size().unstack(0)
+  donation_cubes['cand_census']['count'].unstack(0)
   
 cand_census_pct = cand_census_size.div(cand_census_size.sum(axis = 1), axis = 0)
 
@@ -399,7 +780,7 @@ pylab.show(cand_census_pct.plot(kind = 'barh', stacked = False,
 
 # by economic region
 cand_economic_size = \
-  donations.groupby(['cand_nm', 'economic_region']).size().unstack(0)
+  donation_cubes['cand_economic']['count'].unstack(0)
   
 cand_economic_pct = cand_economic_size.div(cand_economic_size.sum(axis = 1), 
                                            axis = 0)
@@ -409,7 +790,7 @@ pylab.show(cand_economic_pct.plot(kind = 'barh', stacked = False,
 
 # by state
 cand_state_size = \
-  donations.groupby(['cand_nm', 'contbr_st']).size().unstack(0)
+  donation_cubes['cand_state']['count'].unstack(0)
   
 cand_state_pct = cand_state_size.div(cand_state_size.sum(axis = 1), axis = 0)
 
@@ -418,7 +799,7 @@ pylab.show(cand_state_pct.plot(kind = 'bar', stacked = False,
 
 # by donor size
 cand_donor_size = \
-  donations.groupby(['cand_nm', 'donor_size']).size().unstack(0)
+  donation_cubes['cand_size']['count'].unstack(0)
   
 cand_donor_pct = cand_donor_size.div(cand_donor_size.sum(axis = 1), axis = 0)
 
@@ -427,7 +808,7 @@ pylab.show(cand_donor_pct.plot(kind = 'barh', stacked = False,
 
 # census by state
 census_state_size = \
-  donations.groupby(['census_region', 'contbr_st']).size().unstack(0)
+  donation_cubes['census_state']['count'].unstack(0)
   
 census_state_pct = census_state_size.div(census_state_size.sum(axis = 1), axis = 0)
 
@@ -436,7 +817,7 @@ pylab.show(census_state_pct.plot(kind = 'barh', stacked = False,
 
 # economic by state
 economic_region_state_size = \
-  donations.groupby(['economic_region', 'contbr_st']).size().unstack(0)
+  donation_cubes['economic_state']['count'].unstack(0)
   
 economic_state_pct = \
 economic_region_state_size.div(economic_region_state_size.sum(axis = 1), axis = 0)
@@ -446,14 +827,14 @@ pylab.show(economic_region_state_size.plot(kind = 'barh', stacked = False,
 
 # donor by state
 donor_state_size = \
-  donations.groupby(['donor_size', 'contbr_st']).size().unstack(0)
+  donation_cubes['size_state']['count'].unstack(0)
   
 donor_state_pct = \
 donor_state_size.div(donor_state_size.sum(axis = 1), axis = 0)
 
 # donor by census
 donor_census_region_size = \
-  donations.groupby(['donor_size', 'census_region']).size().unstack(0)
+  donation_cubes['size_census']['count'].unstack(0)
   
 donor_census_region_pct = \
 donor_census_region_size.div(donor_census_region_size.sum(axis = 1), axis = 0)
@@ -463,7 +844,7 @@ pylab.show(donor_census_region_pct.plot(kind = 'barh', stacked = False,
                      
 # donor by economic
 donor_economic_region_size = \
-  donations.groupby(['donor_size', 'economic_region']).size().unstack(0)
+  donation_cubes['size_economic']['count'].unstack(0)
   
 donor_economic_region_pct = \
 donor_economic_region_size.div(donor_economic_region_size.sum(axis = 1), axis = 0)
@@ -474,14 +855,14 @@ pylab.show(donor_economic_region_pct.plot(kind = 'barh', stacked = False,
 
 # candidate, donor, economic region
 cand_donor_economic_region_size = \
-  donations.groupby(['cand_nm','donor_size', 'economic_region']).size().unstack(0)
+  donation_cubes['cand_size_economic']['count'].unstack(0)
   
 cand_donor_economic_region_pct = \
 cand_donor_economic_region_size.div(cand_donor_economic_region_size.sum(axis = 1), axis = 0)
 
 # candidate, donor, census region
 cand_donor_census_region_size = \
-  donations.groupby(['cand_nm','donor_size', 'census_region']).size().unstack(0)
+  donation_cubes['cand_size_census']['count'].unstack(0)
   
 cand_donor_census_region_pct = \
 cand_donor_census_region_size.div(cand_donor_census_region_size.sum(axis = 1), axis = 0)
@@ -490,21 +871,21 @@ cand_donor_census_region_size.div(cand_donor_census_region_size.sum(axis = 1), a
 #------------------------------------------------------------------------------ 
 #expenditure summary statistics
 
-# get absolute value of expenditures
-expenditures['expend_amt'] = expenditures['contb_receipt_amt'].abs()
-
-# cut into discrete groups based on amount contributed
-expenditures.loc[:,'payment_size'] = \
-pd.cut(expenditures['expend_amt'], right = True, include_lowest = True,
-       bins = np.array([0, 1e2, 1e3, 1e4, 1e5]),
-       labels = np.array(['micro', 'small', 'medium', 'large']))
+# discrete groups based on absolute amount spent: size_bucket
 
 # summaries and plots for each group and interaction
 # want histograms and summaries
 
+# counts and sums for all groups in one pass
+expenditure_cubes = \
+  summary_cubes(fec_sums['expenditures'], summary_cube_keys('size_bucket'))
+
+# daily counts and sums for the time series plots
+expenditure_daily = daily_cube(fec_sums['expenditures'], 'size_bucket', state_dim)
+
 # by census region
 expend_cand_census_size = \
-  expenditures.groupby(['cand_nm', 'census_region']).size().unstack(0)
+  expenditure_cubes['cand_census']['count'].unstack(0)
   
 expend_cand_census_pct = \
 expend_cand_census_size.div(expend_cand_census_size.sum(axis = 1), axis = 0)
@@ -514,7 +895,7 @@ pylab.show(expend_cand_census_pct.plot(kind = 'barh', stacked = False,
 
 # by economic region
 expend_cand_economic_size = \
-  expenditures.groupby(['cand_nm', 'economic_region']).size().unstack(0)
+  expenditure_cubes['cand_economic']['count'].unstack(0)
   
 expend_cand_economic_pct = \
 expend_cand_economic_size.div(expend_cand_economic_size.sum(axis = 1), axis = 0)
@@ -524,7 +905,7 @@ pylab.show(expend_cand_economic_pct.plot(kind = 'barh', stacked = False,
 
 # by state
 expend_cand_state_size = \
-  expenditures.groupby(['cand_nm', 'contbr_st']).size().unstack(0)
+  expenditure_cubes['cand_state']['count'].unstack(0)
   
 expend_cand_state_pct = \
 expend_cand_state_size.div(expend_cand_state_size.sum(axis = 1), axis = 0)
@@ -534,7 +915,7 @@ pylab.show(expend_cand_state_pct.plot(kind = 'bar', stacked = False,
 
 # by payment size
 cand_payment_size = \
-  expenditures.groupby(['cand_nm', 'payment_size']).size().unstack(0)
+  expenditure_cubes['cand_size']['count'].unstack(0)
   
 cand_payment_pct = cand_payment_size.div(cand_payment_size.sum(axis = 1), axis = 0)
 
@@ -543,7 +924,7 @@ pylab.show(cand_payment_pct.plot(kind = 'barh', stacked = False,
 
 # census by state
 expend_census_state_size = \
-  expenditures.groupby(['census_region', 'contbr_st']).size().unstack(0)
+  expenditure_cubes['census_state']['count'].unstack(0)
   
 expend_census_state_pct = \
 expend_census_state_size.div(expend_census_state_size.sum(axis = 1), axis = 0)
@@ -553,7 +934,7 @@ pylab.show(expend_census_state_pct.plot(kind = 'barh', stacked = False,
 
 # economic by state
 expend_economic_region_state_size = \
-  expenditures.groupby(['economic_region', 'contbr_st']).size().unstack(0)
+  expenditure_cubes['economic_state']['count'].unstack(0)
   
 expend_economic_state_pct = \
 expend_economic_region_state_size.div(expend_economic_region_state_size.sum(axis = 1), axis = 0)
@@ -563,14 +944,14 @@ pylab.show(expend_economic_region_state_size.plot(kind = 'barh', stacked = False
 
 # payment by state
 payment_state_size = \
-  expenditures.groupby(['payment_size', 'contbr_st']).size().unstack(0)
+  expenditure_cubes['size_state']['count'].unstack(0)
   
 payment_state_pct = \
 payment_state_size.div(payment_state_size.sum(axis = 1), axis = 0)
 
 # payment by census
 payment_census_region_size = \
-  expenditures.groupby(['payment_size', 'census_region']).size().unstack(0)
+  expenditure_cubes['size_census']['count'].unstack(0)
   
 payment_census_region_pct = \
 payment_census_region_size.div(payment_census_region_size.sum(axis = 1), axis = 0)
@@ -580,7 +961,7 @@ pylab.show(payment_census_region_pct.plot(kind = 'barh', stacked = False,
                      
 # payment by economic
 payment_economic_region_size = \
-  expenditures.groupby(['payment_size', 'economic_region']).size().unstack(0)
+  expenditure_cubes['size_economic']['count'].unstack(0)
   
 payment_economic_region_pct = \
 payment_economic_region_size.div(payment_economic_region_size.sum(axis = 1), axis = 0)
@@ -591,14 +972,14 @@ pylab.show(payment_economic_region_pct.plot(kind = 'barh', stacked = False,
 
 # candidate, payment, economic region
 cand_payment_economic_region_size = \
-  expenditures.groupby(['cand_nm','payment_size', 'economic_region']).size().unstack(0)
+  expenditure_cubes['cand_size_economic']['count'].unstack(0)
   
 cand_payment_economic_region_pct = \
 cand_payment_economic_region_size.div(cand_payment_economic_region_size.sum(axis = 1), axis = 0)
 
 # candidate, payment, census region
 cand_payment_census_region_size = \
-  expenditures.groupby(['cand_nm','payment_size', 'census_region']).size().unstack(0)
+  expenditure_cubes['cand_size_census']['count'].unstack(0)
   
 cand_payment_census_region_pct = \
 cand_payment_census_region_size.div(cand_payment_census_region_size.sum(axis = 1), axis = 0)
@@ -609,8 +990,7 @@ cand_payment_census_region_size.div(cand_payment_census_region_size.sum(axis = 1
 # donations
 
 # by candidate
-donation_size_cand_time_series = \
-donations.groupby(['cand_nm', 'contb_receipt_dt_format']).size().unstack(0)
+donation_size_cand_time_series = cube_series(donation_daily, 'cand_nm')
 
 donation_size_cand_time_series.plot(title = 'Donations during election cycle')
 plt.xlabel('Date')
@@ -620,12 +1000,13 @@ pylab.show()
 
 
 # since most activity is after the conventions, zoom in from july to november
+# (slices of the daily cubes, no regrouping of the donations)
 
 # census region
 donation_size_census_time_series = \
-donations.groupby(['census_region', 'contb_receipt_dt_format']).size().unstack(0)
+  cube_series(donation_daily, 'census_region', '2012-07', '2012-12')
 
-donation_size_census_time_series.ix['07-2012':'12-2012'].plot()
+donation_size_census_time_series.plot()
 plt.title('Donations during election cycle: census region')
 plt.ylabel('Number of donations')
 plt.xlabel('Date')
@@ -633,9 +1014,9 @@ pylab.show()
 
 # economic region
 donation_size_economic_time_series = \
-donations.groupby(['economic_region', 'contb_receipt_dt_format']).size().unstack(0)
+  cube_series(donation_daily, 'economic_region', '2012-07', '2012-12')
 
-donation_size_economic_time_series.ix['07-2012':'12-2012'].plot()
+donation_size_economic_time_series.plot()
 plt.title('Donations during election cycle: economic region')
 plt.ylabel('Number of donations')
 plt.xlabel('Date')
@@ -643,9 +1024,9 @@ pylab.show()
 
 # donor size
 donation_size_donor_time_series = \
-donations.groupby(['donor_size', 'contb_receipt_dt_format']).size().unstack(0)
+  cube_series(donation_daily, 'size_bucket', '2012-07', '2012-12')
 
-donation_size_donor_time_series.ix['07-2012':'12-2012'].plot()
+donation_size_donor_time_series.plot()
 plt.title('Donations during election cycle: donor size')
 plt.ylabel('Number of donations')
 plt.xlabel('Date')
@@ -653,8 +1034,7 @@ pylab.show()
 
 # expenditures
 # by candidate
-expenditure_size_cand_time_series = \
-expenditures.groupby(['cand_nm', 'contb_receipt_dt_format']).size().unstack(0)
+expenditure_size_cand_time_series = cube_series(expenditure_daily, 'cand_nm')
 
 expenditure_size_cand_time_series.plot()
 plt.title('Expenditures during election cycle')
@@ -664,9 +1044,9 @@ pylab.show()
 
 # census region
 expenditure_size_census_time_series = \
-expenditures.groupby(['census_region', 'contb_receipt_dt_format']).size().unstack(0)
+  cube_series(expenditure_daily, 'census_region', '2012-07', '2012-12')
 
-expenditure_size_census_time_series.ix['07-2012':'12-2012'].plot()
+expenditure_size_census_time_series.plot()
 plt.title('Expenditures during election cycle: census region')
 plt.ylabel('Number of expenditures')
 plt.xlabel('Date')
@@ -675,9 +1055,9 @@ pylab.show()
 
 # economic region
 expenditure_size_economic_time_series = \
-expenditures.groupby(['economic_region', 'contb_receipt_dt_format']).size().unstack(0)
+  cube_series(expenditure_daily, 'economic_region', '2012-07', '2012-12')
 
-expenditure_size_economic_time_series.ix['07-2012':'12-2012'].plot()
+expenditure_size_economic_time_series.plot()
 plt.title('Expenditures during election cycle: economic region')
 plt.ylabel('Number of expenditures')
 plt.xlabel('Date')
@@ -685,9 +1065,9 @@ pylab.show()
 
 # payment size
 expenditure_size_donor_time_series = \
-expenditures.groupby(['payment_size', 'contb_receipt_dt_format']).size().unstack(0)
+  cube_series(expenditure_daily, 'size_bucket', '2012-07', '2012-12')
 
-expenditure_size_donor_time_series.ix['07-2012':'12-2012'].plot()
+expenditure_size_donor_time_series.plot()
 plt.title('Expenditures during election cycle: payment size')
 plt.ylabel('Number of expenditures')
 plt.xlabel('Date')
@@ -709,113 +1089,59 @@ state_data_columns = \
  'one_person_nonfamily', 'one_person_sixty_five_older', 'one_person_at_least_two',
  'avg_per_family', 'avg_per_household', 'eighty_five_over_count', 'eighty_five_over_pct']
 
-fec_net_money_state = \
-fec_final.groupby(state_data_columns, as_index = False)[['contb_receipt_amt']].sum()
-
-
-fec_census_net_money_state = \
-fec_final.groupby(state_data_columns, as_index = False)[['contb_receipt_amt']].sum()
-                  
-                
-fec_economic_net_money_state = \
-fec_final.groupby(state_data_columns, as_index = False)[['contb_receipt_amt']].sum()
-
-
-# donation sums
-donations_cand_sum_state = \
-donations.groupby(state_data_columns, 
-                  as_index = False)[['contb_receipt_amt']].sum()
-
-donations_cand__census_sum_state = \
-donations.groupby(state_data_columns,
-                   as_index = False)[['contb_receipt_amt']].sum()
-
-donations_cand__economic_sum_state = \
-donations.groupby(state_data_columns,
-                   as_index = False)[['contb_receipt_amt']].sum()
-
-# expenditure sums
-expenditures_cand_sum_state = \
-expenditures.groupby(state_data_columns, 
-                     as_index = False)[['contb_receipt_amt']].sum()
-
-expenditures_cand__census_sum_state = \
-expenditures.groupby(state_data_columns, as_index = False)[['contb_receipt_amt']].sum()
-
-expenditures_cand__economic_sum_state = \
-expenditures.groupby(state_data_columns,as_index = False)[['contb_receipt_amt']].sum()
-
-
-# writing files for importation into R
-
-fec_net_money_state.to_csv('fec-data-net-contributions-state.csv')
-fec_census_net_money_state.to_csv('fec-data-census-regions-net-contributions-state.csv')
-fec_economic_net_money_state.to_csv('fec-data-economic-regions-net-contributions-state.csv')
-
-donations_cand_sum_state.to_csv('donation-data-candidate-idx-state.csv')
-donations_cand__census_sum_state.to_csv('donation-data-census-regions-candidate-idx-state.csv')
-donations_cand__economic_sum_state.to_csv('donation-data-economic-regions-candidate-idx-state.csv')
-
-expenditures_cand_sum_state.to_csv('expenditure-data-candidate-idx-state.csv')
-expenditures_cand__census_sum_state.to_csv('expenditure-data-census-regions-candidate-idx-state.csv')
-expenditures_cand__economic_sum_state.to_csv('expenditure-data-economic-regions-candidate-idx-state.csv')
+# file name: (source frame, group keys) of the summed amounts
+state_export_specs = OrderedDict([
+  ('fec-data-net-contributions-state.csv', ('fec_final', state_data_columns)),
+  ('fec-data-census-regions-net-contributions-state.csv',
+   ('fec_final', state_data_columns)),
+  ('fec-data-economic-regions-net-contributions-state.csv',
+   ('fec_final', state_data_columns)),
+  ('donation-data-candidate-idx-state.csv', ('donations', state_data_columns)),
+  ('donation-data-census-regions-candidate-idx-state.csv',
+   ('donations', state_data_columns)),
+  ('donation-data-economic-regions-candidate-idx-state.csv',
+   ('donations', state_data_columns)),
+  ('expenditure-data-candidate-idx-state.csv', ('expenditures', state_data_columns)),
+  ('expenditure-data-census-regions-candidate-idx-state.csv',
+   ('expenditures', state_data_columns)),
+  ('expenditure-data-economic-regions-candidate-idx-state.csv',
+   ('expenditures', state_data_columns))])
 
 
 #------------------------------------------------------------------------------ 
 # R-style data frame export: candidate and amount data (breakout detection)
 
-fec_net_money = \
-fec_final.groupby(['cand_nm', 'contb_receipt_dt_format'], 
-                  as_index = False)[['contb_receipt_amt']].sum()
-
-
-fec_census_net_money = \
-fec_final.groupby(['cand_nm', 'census_region', 'contb_receipt_dt_format'], 
-                  as_index = False)[['contb_receipt_amt']].sum()
-                  
-                
-fec_economic_net_money = \
-fec_final.groupby(['cand_nm', 'economic_region', 'contb_receipt_dt_format'], 
-                  as_index = False)[['contb_receipt_amt']].sum()
-
-
-# donation sums
-donations_cand_sum = \
-donations.groupby(['cand_nm', 'contb_receipt_dt_format'], 
-                  as_index = False)[['contb_receipt_amt']].sum()
-
-donations_cand__census_sum = \
-donations.groupby(['cand_nm', 'census_region','contb_receipt_dt_format'],
-                   as_index = False)[['contb_receipt_amt']].sum()
-
-donations_cand__economic_sum = \
-donations.groupby(['cand_nm', 'economic_region','contb_receipt_dt_format'],
-                   as_index = False)[['contb_receipt_amt']].sum()
-
-# expenditure sums
-expenditures_cand_sum = \
-expenditures.groupby(['cand_nm', 'contb_receipt_dt_format'], 
-                     as_index = False)[['contb_receipt_amt']].sum()
+cand_keys = ['cand_nm', 'contb_receipt_dt_format']
+cand_census_keys = ['cand_nm', 'census_region', 'contb_receipt_dt_format']
+cand_economic_keys = ['cand_nm', 'economic_region', 'contb_receipt_dt_format']
 
-expenditures_cand__census_sum = \
-expenditures.groupby(['cand_nm', 'census_region','contb_receipt_dt_format'], 
-                     as_index = False)[['contb_receipt_amt']].sum()
+cand_export_specs = OrderedDict([
+  ('fec-data-net-contributions.csv', ('fec_final', cand_keys)),
+  ('fec-data-census-regions-net-contributions.csv', ('fec_final', cand_census_keys)),
+  ('fec-data-economic-regions-net-contributions.csv',
+   ('fec_final', cand_economic_keys)),
+  ('donation-data-candidate-idx.csv', ('donations', cand_keys)),
+  ('donation-data-census-regions-candidate-idx.csv', ('donations', cand_census_keys)),
+  ('donation-data-economic-regions-candidate-idx.csv',
+   ('donations', cand_economic_keys)),
+  ('expenditure-data-candidate-idx.csv', ('expenditures', cand_keys)),
+  ('expenditure-data-census-regions-candidate-idx.csv',
+   ('expenditures', cand_census_keys)),
+  ('expenditure-data-economic-regions-candidate-idx.csv',
+   ('expenditures', cand_economic_keys))])
 
-expenditures_cand__economic_sum = \
-expenditures.groupby(['cand_nm', 'economic_region','contb_receipt_dt_format'],
-                      as_index = False)[['contb_receipt_amt']].sum()
 
+# each distinct aggregation is computed once for all files
+export_specs = OrderedDict(list(state_export_specs.items()) +
+                           list(cand_export_specs.items()))
 
-# writing files for importation into R
+# base sums are kept up to date by update_fec_store (out of core: rolled
+# up from the partial sums)
+exports = export_sums(fec_sums, export_specs, state_dim,
+                      base_sums = None if out_of_core else fec_manifest['base_sums'])
 
-fec_net_money.to_csv('fec-data-net-contributions.csv')
-fec_census_net_money.to_csv('fec-data-census-regions-net-contributions.csv')
-fec_economic_net_money.to_csv('fec-data-economic-regions-net-contributions.csv')
 
-donations_cand_sum.to_csv('donation-data-candidate-idx.csv')
-donations_cand__census_sum.to_csv('donation-data-census-regions-candidate-idx.csv')
-donations_cand__economic_sum.to_csv('donation-data-economic-regions-candidate-idx.csv')
+# writing files for importation into R (CSV and Feather)
 
-expenditures_cand_sum.to_csv('expenditure-data-candidate-idx.csv')
-expenditures_cand__census_sum.to_csv('expenditure-data-census-regions-candidate-idx.csv')
-expenditures_cand__economic_sum.to_csv('expenditure-data-economic-regions-candidate-idx.csv')
+for filename, export in exports.items():
+    write_export(export, filename)